@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+'''
+@File    :   benchmark.py
+@Project :
+@Time    :   2026/10/17 15:40:37
+@Author  :   Siyuan Wu
+@Version :   1.0
+@Contact :   sywu@iphy.ac.cn
+'''
+
+### 用法：python benchmark.py --rows 10000 --chunk-rows 500 --workers 4 --latency 0.005
+### 在本地模拟服务器上回放按行数放大的input.csv，统计导入/更新/导出的吞吐量、请求延迟分位数与内存峰值
+### python benchmark.py --startup 10 --max-startup-ms 300：在新解释器中统计导入iop_eln到首次上传完成的耗时
+
+import os, sys, json, time, argparse, subprocess, tracemalloc
+from typing import List
+import numpy as np
+import pandas as pd
+from iop_eln import eln, eln_transport, eln_template, eln_html
+from mock_server import eln_mock_server
+
+class timed_transport(eln_transport):
+    """记录每次请求耗时的连接池"""
+    def __init__(self,**kwargs) -> None:
+        super().__init__(**kwargs)
+        self.latency = []
+
+    def post(self,url:str,**kwargs):
+        start = time.perf_counter()
+        try:
+            return super().post(url,**kwargs)
+        finally:
+            self.latency.append(time.perf_counter() - start)
+
+def percentile(values:List[float],q:float) -> float:
+    return float(np.percentile(values,q)) if len(values) > 0 else float("nan")
+
+def load_rows(path:str,rows:int) -> pd.DataFrame:
+    data = pd.read_csv(path,index_col=0)
+    data = data.iloc[np.arange(rows) % len(data)]
+    data.index = [f"arXiv_{i}" for i in range(rows)]
+    return data
+
+def my_template(data:pd.Series):
+    return  [
+             {
+             "data type":"richtext",
+             "data name":"标题",
+             "data":f"""<p align="center"><font style="font-size:24px"><b><a href="{data["url"]}" title="{data["url"]}" target="_blank">{eln_html.escape_text(data["title"])}</a></b></font></p>"""
+             },
+             {
+             "data type":"richtext",
+             "data name":"作者",
+             "data":data["author"]
+             },
+             {
+             "data type":"richtext",
+             "data name":"领域",
+             "data":data["subject"]
+             },
+             {
+             "data type":"richtext",
+             "data name":"摘要",
+             "data":eln_html.escape_text(data["abstract"])
+             }
+            ]
+
+column_template = eln_template([
+                                {"format":'<p align="center"><font style="font-size:24px"><b><a href="{url}" title="{url}" target="_blank">{title}</a></b></font></p>',
+                                 "data name":"标题","data type":"richtext"},
+                                {"column":"author","data name":"作者","data type":"richtext"},
+                                {"column":"subject","data name":"领域","data type":"richtext"},
+                                {"column":"abstract","data name":"摘要","data type":"richtext"},
+                               ])
+
+startup_script = """
+import sys, time, json
+start = time.perf_counter()
+import iop_eln
+imported = time.perf_counter()
+client = iop_eln.eln(token_store=False,base_url=sys.argv[1],token_url=sys.argv[2])
+client.import_data(eln_name="测试",template_name="startup",title_list=["startup"],uid_list=["startup"],
+                   keyword_list=["startup"],dataset_in=[{"温度":300.,"样品":"startup"}])
+done = time.perf_counter()
+print(json.dumps({"import ms":(imported - start) * 1e3,
+                  "first request ms":(done - imported) * 1e3,
+                  "total ms":(done - start) * 1e3,
+                  "pandas loaded":"pandas" in sys.modules}))
+"""
+
+def run_startup(repeats:int) -> pd.DataFrame:
+    """每次在新的解释器中导入iop_eln并上传一条表单记录"""
+    results = []
+    with eln_mock_server() as server:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable,"-c",startup_script,server.base_url,server.token_url],
+                                 capture_output=True,text=True,check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+            results.append({"process ms":(time.perf_counter() - start) * 1e3,**json.loads(out.stdout)})
+    return pd.DataFrame(results)
+
+def run_case(name:str,client:eln,rows:int,func,trace_memory:bool) -> dict:
+    client.transport.latency = []
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else float("nan")
+    if trace_memory:
+        tracemalloc.stop()
+    latency = client.transport.latency
+    return {
+            "case":name,
+            "rows":rows,
+            "seconds":elapsed,
+            "rows/s":rows / elapsed if elapsed > 0 else float("inf"),
+            "requests":len(latency),
+            "p50 ms":percentile(latency,50) * 1e3,
+            "p95 ms":percentile(latency,95) * 1e3,
+            "p99 ms":percentile(latency,99) * 1e3,
+            "peak MB":peak / 2 ** 20,
+            }
+
+def main():
+    parser = argparse.ArgumentParser(description="iop_eln导入/更新/导出性能基准")
+    parser.add_argument("--input",default=os.path.join(os.path.dirname(os.path.abspath(__file__)),"input.csv"))
+    parser.add_argument("--rows",type=int,nargs="+",default=[10000])
+    parser.add_argument("--chunk-rows",type=int,default=500)
+    parser.add_argument("--workers",type=int,default=4)
+    parser.add_argument("--latency",type=float,default=0.)
+    parser.add_argument("--jitter",type=float,default=0.)
+    parser.add_argument("--error-rate",type=float,default=0.)
+    parser.add_argument("--no-memory",action="store_true",help="不统计内存峰值（tracemalloc会拖慢运行）")
+    parser.add_argument("--output",default=None,help="结果另存为CSV")
+    parser.add_argument("--startup",type=int,default=0,help="只运行启动基准，重复次数")
+    parser.add_argument("--max-startup-ms",type=float,default=None,help="导入到首次上传完成的中位耗时超过该值时返回非零")
+    args = parser.parse_args()
+
+    os.environ.setdefault("eln_username","benchmark")
+    os.environ.setdefault("eln_password","benchmark")
+    if args.startup > 0:
+        out = run_startup(args.startup)
+        print(out.to_string(index=False,float_format="%.1f"))
+        median = out["total ms"].median()
+        print(f"median import+first request: {median:.1f} ms, pandas loaded: {bool(out['pandas loaded'].any())}")
+        if args.output is not None:
+            out.to_csv(args.output,index=False)
+        if args.max_startup_ms is not None and median > args.max_startup_ms:
+            sys.exit(1)
+        return
+    results = []
+    for rows in args.rows:
+        data = load_rows(args.input,rows)
+        with eln_mock_server(latency=args.latency,jitter=args.jitter,error_rate=args.error_rate,seed=0) as server:
+            client = eln(transport=timed_transport(pool_size=args.workers,backoff_factor=0.01),
+                         token_store=False,
+                         base_url=server.base_url,
+                         token_url=server.token_url)
+            uid = "arXiv"
+            cases = [
+                     ("import_data",lambda: client.import_data(eln_name="测试",
+                                                               template_name="arXiv更新",
+                                                               title_list=list(data["title"]),
+                                                               uid_list=list(data.index),
+                                                               keyword_list=["arXiv"] * rows,
+                                                               dataset_in=[{"url":url} for url in data["url"]],
+                                                               chunk_rows=args.chunk_rows,
+                                                               max_workers=args.workers)),
+                     ("update_dataset data_func",lambda: client.update_dataset(eln_name="测试",
+                                                                              uid=uid,
+                                                                              module_name=[f"{index}_func" for index in data.index],
+                                                                              module_type=["form"] * rows,
+                                                                              data_func=my_template,
+                                                                              data_in=data,
+                                                                              chunk_rows=args.chunk_rows,
+                                                                              max_workers=args.workers)),
+                     ("update_dataset template",lambda: client.update_dataset(eln_name="测试",
+                                                                             uid=uid,
+                                                                             module_name=[f"{index}_template" for index in data.index],
+                                                                             module_type=["form"] * rows,
+                                                                             data_func=column_template,
+                                                                             data_in=data,
+                                                                             chunk_rows=args.chunk_rows,
+                                                                             max_workers=args.workers)),
+                     ("export_data",lambda: client.export_data("测试",lambda frame: frame["data"].to_dict(),uids=[uid])),
+                     ("iter_export",lambda: sum(1 for _ in client.iter_export("测试",uids=[uid]))),
+                     ("export_frame",lambda: client.export_frame("测试",uids=[uid])),
+                    ]
+            client.import_data(eln_name="测试",template_name="arXiv更新",title_list=["arXiv"],uid_list=[uid],
+                               keyword_list=["arXiv"],dataset_in=[{"Introduction":"arXiv文献"}])
+            for name,func in cases:
+                results.append(run_case(name,client,rows,func,not args.no_memory))
+                print(f"{rows} {name}: {results[-1]['seconds']:.2f} s",flush=True)
+            client.close()
+    out = pd.DataFrame(results)
+    print(out.to_string(index=False,float_format="%.2f"))
+    if args.output is not None:
+        out.to_csv(args.output,index=False)
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,1282 @@
 @Contact :   sywu@iphy.ac.cn
 '''
 
-import os, requests, datetime
+from __future__ import annotations ### 类型注解不在导入时求值，pandas等按需导入
+
+import os, sys, datetime, time, json, hashlib, threading, contextlib, codecs, string, sqlite3, logging, queue, collections, importlib, importlib.util, glob, uuid, tempfile
+from urllib.parse import quote as url_quote
+from concurrent.futures import ThreadPoolExecutor, Future, Executor
 from typing import Dict, List, Union
-import pandas as pd
+
+class eln_lazy_module():
+    """首次访问属性时才导入的模块：只生成payload时无需加载pandas、numpy、requests等"""
+    def __init__(self,name:str) -> None:
+        self._name = name
+        self._module = None
+
+    @property
+    def loaded(self) -> bool:
+        ### 未导入的模块不可能产生其类型的对象，可据此跳过isinstance检查
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self,attr:str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module,attr)
+
+np = eln_lazy_module("numpy")
+pd = eln_lazy_module("pandas")
+requests = eln_lazy_module("requests")
+asyncio = eln_lazy_module("asyncio")
+aiohttp = eln_lazy_module("aiohttp") ### 仅异步客户端需要
+try:
+    import orjson
+except ImportError: ### 可选的快速JSON序列化
+    orjson = None
+try:
+    import fcntl
+except ImportError: ### Windows
+    fcntl = None
+    import msvcrt
+
+class eln_metrics():
+    """
+    物理所电子实验平台请求指标：按接口统计请求次数、耗时、收发字节数、重试与Token刷新次数、
+    以及本地生成/序列化数据的耗时；可注册回调、写入结构化日志或导出为Prometheus文本
+    """
+    buckets = [0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.,2.5,5.,10.,30.,60.]
+
+    def __init__(self,
+                 hooks:Union[list,None] = None,
+                 logger:Union[logging.Logger,None] = None) -> None:
+        self.hooks = [] if hooks is None else list(hooks)
+        self.logger = logger
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self,hook):
+        self.hooks.append(hook)
+
+    def event(self,
+              name:str,
+              seconds:Union[float,None] = None,
+              **fields):
+        """
+        记录一次事件：字符串字段作为标签，数值字段累加；回调与日志收到完整的事件字典
+        """
+        labels = tuple(sorted((key,value) for key,value in fields.items() if isinstance(value,str)))
+        with self._lock:
+            stat = self.stats.setdefault((name,labels),{"count":0,"values":{}})
+            stat["count"] += 1
+            if seconds is not None:
+                if "seconds" not in stat:
+                    stat["seconds"],stat["buckets"] = 0.,[0] * len(self.buckets)
+                stat["seconds"] += seconds
+                for i,bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        stat["buckets"][i] += 1
+            for key,value in fields.items():
+                if isinstance(value,(int,float)) and not isinstance(value,bool):
+                    stat["values"][key] = stat["values"].get(key,0) + value
+        if len(self.hooks) > 0 or self.logger is not None:
+            out = {"event":name,"time":time.time(),**fields}
+            if seconds is not None:
+                out["seconds"] = seconds
+            for hook in self.hooks:
+                hook(out)
+            if self.logger is not None:
+                self.logger.info(json.dumps(out,ensure_ascii=False,default=str))
+
+    @contextlib.contextmanager
+    def timer(self,name:str,**fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.event(name,time.perf_counter() - start,**fields)
+
+    def summary(self) -> List[dict]:
+        with self._lock:
+            return [{"event":name,**dict(labels),"count":stat["count"],
+                     **({"seconds":stat["seconds"]} if "seconds" in stat else {}),**stat["values"]}
+                    for (name,labels),stat in self.stats.items()]
+
+    def prometheus(self,prefix:str = "eln") -> str:
+        def label_text(labels,extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{key}="{value}"' for key,value in items) + "}" if len(items) > 0 else ""
+        lines = []
+        with self._lock:
+            for (name,labels),stat in sorted(self.stats.items()):
+                lines.append(f"{prefix}_{name}_total{label_text(labels)} {stat['count']}")
+                if "seconds" in stat:
+                    for bound,count in zip(self.buckets,stat["buckets"]):
+                        lines.append(f"{prefix}_{name}_seconds_bucket{label_text(labels,[('le',bound)])} {count}")
+                    lines.append(f"{prefix}_{name}_seconds_bucket{label_text(labels,[('le','+Inf')])} {stat['count']}")
+                    lines.append(f"{prefix}_{name}_seconds_sum{label_text(labels)} {stat['seconds']}")
+                    lines.append(f"{prefix}_{name}_seconds_count{label_text(labels)} {stat['count']}")
+                for key,value in stat["values"].items():
+                    lines.append(f"{prefix}_{name}_{key}_total{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+def eln_endpoint(url:str) -> str:
+    name = url.split("?")[0].rsplit("/",1)[-1]
+    if name.startswith("eln_api_"):
+        name = name[len("eln_api_"):]
+    return name.split(".")[0]
+
+def eln_response_json(response):
+    """
+    解析响应体JSON并缓存在响应对象上：重试判断、errcode检查与读取数据共用一次解析；
+    不是JSON时每次都抛出同一个ValueError
+    """
+    out = response.__dict__.get("_eln_json",eln_response_json)
+    if out is eln_response_json:
+        try:
+            out = response.json()
+        except ValueError as e:
+            out = e
+        response._eln_json = out
+    if isinstance(out,ValueError):
+        raise out
+    return out
+
+def eln_json_default(obj,fallback = None):
+    ### 标准库json遇到NumPy数组、pandas序列与NumPy标量时转为Python对象
+    if pd.loaded and isinstance(obj,(pd.Series,pd.Index)):
+        obj = obj.to_numpy()
+    if np.loaded and isinstance(obj,np.ndarray):
+        return obj.tolist()
+    if np.loaded and isinstance(obj,np.generic):
+        return obj.item()
+    if fallback is not None:
+        return fallback(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def eln_orjson_default(obj):
+    ### orjson直接序列化连续存储的数值/布尔数组，不生成中间列表；其余类型回退到eln_json_default
+    if pd.loaded and isinstance(obj,(pd.Series,pd.Index)):
+        return obj.to_numpy()
+    if np.loaded and isinstance(obj,np.ndarray) and obj.dtype.kind in "biuf" and not obj.flags.c_contiguous:
+        return np.ascontiguousarray(obj)
+    return eln_json_default(obj)
+
+def eln_module_frame(module:dict) -> pd.DataFrame:
+    return pd.DataFrame(module["data"]).set_index("name")[["data","type"]]
+
+def eln_pyarrow(name:Union[str,None] = None):
+    ### 按需导入pyarrow或其子模块（parquet/ipc）
+    try:
+        return importlib.import_module("pyarrow" if name is None else f"pyarrow.{name}")
+    except ImportError:
+        raise ImportError("Parquet/Arrow读写需要安装pyarrow！")
+
+def eln_read_chunks(path:str,
+                    chunksize:int,
+                    **read_kwargs):
+    """
+    分块读取CSV或Parquet（.parquet/.pq，需要pyarrow），逐块返回DataFrame；
+    Parquet中没有保存索引时与CSV一样按全文件行号编号
+    """
+    if not path.lower().endswith((".parquet",".pq")):
+        yield from pd.read_csv(path,chunksize=chunksize,**read_kwargs)
+        return
+    parquet = eln_pyarrow("parquet")
+    index_col = read_kwargs.pop("index_col",None)
+    offset = 0
+    for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunksize,**read_kwargs):
+        frame = batch.to_pandas()
+        if index_col is not None:
+            frame = frame.set_index(frame.columns[index_col] if isinstance(index_col,int) else index_col)
+        elif isinstance(frame.index,pd.RangeIndex):
+            frame.index = pd.RangeIndex(offset,offset + len(frame))
+        offset += len(frame)
+        yield frame
+
+def eln_count_rows(path:str) -> Union[int,None]:
+    ### Parquet从元数据读取行数；CSV需要完整扫描，返回None
+    if path.lower().endswith((".parquet",".pq")):
+        try:
+            return importlib.import_module("pyarrow.parquet").ParquetFile(path).metadata.num_rows
+        except ImportError:
+            return None
+    return None
+
+def eln_same_value(a,b) -> bool:
+    ### 数字按数值比较（服务器可能把1返回为1.0），其余按规范化JSON比较
+    numbers = (int,float)
+    if isinstance(a,numbers) and isinstance(b,numbers) and not isinstance(a,bool) and not isinstance(b,bool):
+        return float(a) == float(b)
+    dumps = lambda value: json.dumps(value,sort_keys=True,ensure_ascii=False,default=eln_json_default)
+    return dumps(a) == dumps(b)
+
+def eln_apply_batch(data_func,modules:List[dict]) -> list:
+    ### 在进程池中执行：传入原始模块字典，在子进程内构建DataFrame
+    return [data_func(eln_module_frame(module)) for module in modules]
+
+class eln_limiter():
+    """
+    物理所电子实验平台自适应限流：按AIMD调整并发请求数与可选的每秒请求数。
+    延迟稳定时缓慢增加，遇到errcode 3、超时或5xx时成倍减少
+    """
+    def __init__(self,
+                 initial:int = 4,
+                 min_limit:int = 1,
+                 max_limit:int = 64,
+                 rate:Union[float,None] = None,
+                 min_rate:float = 0.5,
+                 max_rate:Union[float,None] = None,
+                 increase:float = 1.,
+                 decrease:float = 0.5,
+                 tolerance:float = 2.,
+                 smoothing:float = 0.1) -> None:
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = rate ### None时不限制每秒请求数
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance ### 延迟超过基线的tolerance倍时停止增加
+        self.smoothing = smoothing
+        self.inflight = 0
+        self.latency = None ### 成功请求延迟的指数滑动平均
+        self.baseline = None ### 近期最小延迟
+        self.overloads = 0
+        self._tokens = 1.
+        self._refill = time.monotonic()
+        self._last_decrease = 0.
+        self._cond = threading.Condition()
+
+    def reserve(self) -> float:
+        ### 调用方需持有锁；取得名额时返回0，否则返回建议等待秒数
+        if self.inflight >= max(self.min_limit,int(self.limit)):
+            return 0.01
+        if self.rate is not None:
+            now = time.monotonic()
+            self._tokens = min(max(1.,self.rate),self._tokens + (now - self._refill) * self.rate)
+            self._refill = now
+            if self._tokens < 1.:
+                return (1. - self._tokens) / self.rate
+            self._tokens -= 1.
+        self.inflight += 1
+        return 0.
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.reserve()
+                if wait == 0.:
+                    return
+                self._cond.wait(wait)
+
+    async def acquire_async(self):
+        while True:
+            with self._cond:
+                wait = self.reserve()
+            if wait == 0.:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self,
+                seconds:Union[float,None] = None,
+                overload:bool = False):
+        """
+        归还名额并反馈结果：overload为True时成倍减少（每个延迟周期最多一次），
+        否则在延迟未明显高于基线时增加
+        """
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            if overload:
+                self.overloads += 1
+                if now - self._last_decrease >= (self.latency or 0.):
+                    self._last_decrease = now
+                    self.limit = max(float(self.min_limit),self.limit * self.decrease)
+                    if self.rate is not None:
+                        self.rate = max(self.min_rate,self.rate * self.decrease)
+            elif seconds is not None:
+                self.latency = seconds if self.latency is None else (1 - self.smoothing) * self.latency + self.smoothing * seconds
+                ### 基线缓慢上浮，以适应服务器整体变慢
+                self.baseline = seconds if self.baseline is None else min(seconds,self.baseline * (1 + self.smoothing))
+                if seconds <= self.tolerance * self.baseline:
+                    self.limit = min(float(self.max_limit),self.limit + self.increase / max(1.,self.limit))
+                    if self.rate is not None:
+                        rate = self.rate + self.increase / max(1.,self.rate)
+                        self.rate = rate if self.max_rate is None else min(self.max_rate,rate)
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                    "limit":int(self.limit),
+                    "inflight":self.inflight,
+                    "rate":self.rate,
+                    "latency":self.latency,
+                    "baseline":self.baseline,
+                    "overloads":self.overloads,
+                    }
+
+class eln_transport():
+    """
+    物理所电子实验平台连接池：复用连接，有限次指数退避重试。
+    timeout默认不限，可设为秒数或(连接,读取)；写入请求只在确认未发出（连接失败、连接超时）
+    或服务器返回5xx/errcode 3时重试，读取超时可能已被服务器处理，不重试
+    """
+    def __init__(self,
+                 pool_size:int = 10,
+                 timeout:Union[float,tuple,None] = None,
+                 max_retries:int = 3,
+                 backoff_factor:float = 0.5,
+                 backoff_max:float = 30.,
+                 metrics:Union[eln_metrics,None] = None,
+                 limiter:Union[eln_limiter,None] = None,
+                 json_backend:str = "json") -> None:
+        if json_backend not in ["json","orjson"]:
+            raise ValueError("json_backend应为“json”或“orjson”！")
+        if json_backend == "orjson" and orjson is None:
+            raise ImportError("json_backend=\"orjson\"需要安装orjson！")
+        self.metrics = metrics
+        self.limiter = limiter
+        self.json_backend = json_backend
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self._session = None
+
+    @property
+    def session(self):
+        ### 首次发送请求时才导入requests并建立连接池
+        if self._session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                    pool_maxsize=self.pool_size,
+                                                    max_retries=0)
+            session.mount("https://",adapter)
+            session.mount("http://",adapter)
+            self._session = session
+        return self._session
+
+    def backoff(self,attempt:int) -> float:
+        return min(self.backoff_max,self.backoff_factor * (2 ** attempt))
+
+    def need_retry(self,response) -> bool:
+        if response.status_code >= 500:
+            return True
+        try:
+            return eln_response_json(response).get("errcode") == 3
+        except (ValueError,AttributeError):
+            return False
+
+    def unsent(self,error) -> bool:
+        """异常是否发生在请求发出之前"""
+        if isinstance(error,requests.ConnectTimeout):
+            return True
+        from urllib3.exceptions import ConnectTimeoutError ### 拒绝连接、域名解析失败均为其子类
+        reason = getattr(error.args[0],"reason",None) if len(error.args) > 0 else None
+        return isinstance(error,requests.ConnectionError) and isinstance(reason,ConnectTimeoutError)
+
+    def dumps(self,data) -> bytes:
+        ### 与requests的json参数一致；orjson将NaN写为null而不是报错
+        if self.json_backend == "orjson":
+            return orjson.dumps(data,default=eln_orjson_default,option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(data,allow_nan=False,default=eln_json_default).encode("utf-8")
+
+    def post(self,url:str,idempotent:bool = False,**kwargs):
+        """idempotent为True（登录、查询、导出）时连接中断与读取超时也重试"""
+        kwargs.setdefault("timeout",self.timeout)
+        metrics = self.metrics
+        endpoint = eln_endpoint(url) if metrics is not None else None
+        if "json" in kwargs:
+            ### 只序列化一次，重试时复用
+            start = time.perf_counter()
+            kwargs["data"] = self.dumps(kwargs.pop("json"))
+            if metrics is not None:
+                metrics.event("serialize",time.perf_counter() - start,endpoint=endpoint,bytes=len(kwargs["data"]))
+        limiter = self.limiter
+        ### 文件对象作为请求体时流式发送，重试前回到起始位置
+        position = kwargs["data"].tell() if hasattr(kwargs.get("data"),"seek") else None
+        for attempt in range(self.max_retries + 1):
+            if position is not None:
+                kwargs["data"].seek(position)
+            if limiter is not None:
+                limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url=url,**kwargs)
+            except (requests.ConnectionError,requests.Timeout) as e:
+                if limiter is not None:
+                    limiter.release(overload=True)
+                if metrics is not None:
+                    metrics.event("request",time.perf_counter() - start,endpoint=endpoint,status=type(e).__name__)
+                if attempt >= self.max_retries or not (idempotent or self.unsent(e)):
+                    raise
+            except BaseException:
+                if limiter is not None:
+                    limiter.release()
+                raise
+            else:
+                if limiter is not None:
+                    ### 超时、5xx与errcode 3视为服务器过载
+                    seconds = time.perf_counter() - start
+                    overload = response.status_code >= 500 if kwargs.get("stream") else self.need_retry(response)
+                    if kwargs.get("stream") and not overload:
+                        self.release_on_close(response,seconds)
+                    else:
+                        limiter.release(seconds,overload)
+                if metrics is not None:
+                    metrics.event("request",time.perf_counter() - start,
+                                  endpoint=endpoint,
+                                  status=str(response.status_code),
+                                  request_bytes=len(kwargs["data"]) if isinstance(kwargs.get("data"),bytes) else 0,
+                                  response_bytes=int(response.headers.get("Content-Length",0)) if kwargs.get("stream") else len(response.content))
+                ### 流式响应不读取响应体，只按状态码重试
+                if attempt >= self.max_retries or (
+                   response.status_code < 500 if kwargs.get("stream") else not self.need_retry(response)):
+                    return response
+                response.close()
+            if metrics is not None:
+                metrics.event("retry",endpoint=endpoint)
+            time.sleep(self.backoff(attempt))
+
+    def release_on_close(self,response,seconds:float):
+        ### 流式响应读完响应体并关闭后才归还名额，延迟仍按收到响应头的时间反馈
+        close = response.close
+        def release():
+            if response.close is release:
+                response.close = close
+                self.limiter.release(seconds)
+            close()
+        response.close = release
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+class eln_token_store():
+    """
+    物理所电子实验平台Token缓存：写入磁盘并加文件锁，供多线程、多进程共享，过期前主动刷新
+    """
+    def __init__(self,
+                 path:Union[str,None] = None,
+                 ttl:float = 3600.,
+                 refresh_margin:float = 300.) -> None:
+        if path is None:
+            path = os.getenv("eln_token_cache",
+                             os.path.join(os.path.expanduser("~"),".iop_eln","token.json"))
+        self.path = path
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.error = None ### 最近一次无法读写缓存的原因
+        self._lock = threading.Lock()
+
+    def key(self,url:str,username:str) -> str:
+        return hashlib.sha256(f"{url}|{username}".encode("utf-8")).hexdigest()
+
+    def valid(self,entry:Union[dict,None]) -> bool:
+        return entry is not None and entry["expires"] - self.refresh_margin > time.time()
+
+    @contextlib.contextmanager
+    def locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok=True)
+        with self._lock, open(self.path + ".lock","a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(),fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(),msvcrt.LK_LOCK,1)
+                        break
+                    except OSError:
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(),fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(),msvcrt.LK_UNLCK,1)
+
+    def read(self) -> dict:
+        try:
+            with open(self.path,encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError,ValueError):
+            return {}
+
+    def write(self,tokens:dict):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o600)
+        with os.fdopen(fd,"w",encoding="utf-8") as f:
+            json.dump(tokens,f)
+        os.replace(tmp,self.path)
+
+    def get(self,url:str,username:str,fetch,stale:Union[str,None] = None) -> tuple:
+        """
+        读取有效Token，缓存中没有、即将过期或与stale相同时调用fetch()重新登录
+        """
+        key = self.key(url,username)
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(self.locked())
+            except OSError as e:
+                ### 缓存目录不可写（如HOME只读）时不缓存，只在内存中保存Token
+                self.error = repr(e)
+                return fetch()
+            tokens = self.read()
+            entry = tokens.get(key)
+            if self.valid(entry) and entry["token"] != stale:
+                return entry["token"],entry["expires"]
+            token,expires = fetch()
+            tokens = {k:v for k,v in tokens.items() if v["expires"] > time.time()}
+            tokens[key] = {"token":token,"expires":expires}
+            try:
+                self.write(tokens)
+            except OSError as e:
+                self.error = repr(e)
+            return token,expires
+
+class eln_sync_index():
+    """
+    物理所电子实验平台本地同步索引（SQLite）：按(eln,uid,模块名)记录已上传模块内容的哈希
+    """
+    def __init__(self,
+                 path:Union[str,None] = None) -> None:
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"),".iop_eln","sync.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS modules (
+                                      eln TEXT NOT NULL,
+                                      uid TEXT NOT NULL,
+                                      module TEXT NOT NULL,
+                                      hash TEXT NOT NULL,
+                                      updated REAL NOT NULL,
+                                      PRIMARY KEY (eln,uid,module))""")
+
+    def hash(self,row:tuple) -> str:
+        return hashlib.sha256(json.dumps(row,sort_keys=True,ensure_ascii=False,default=lambda obj: eln_json_default(obj,str)).encode("utf-8")).hexdigest()
+
+    def known(self,eln_name:str,uid:str,module_names:List[str]) -> Dict[str,str]:
+        out = {}
+        with self._lock:
+            for i in range(0,len(module_names),500):
+                names = module_names[i:i+500]
+                out.update(self._conn.execute(f"""SELECT module,hash FROM modules
+                                                  WHERE eln=? AND uid=? AND module IN ({",".join("?" * len(names))})""",
+                                              [eln_name,uid] + names).fetchall())
+        return out
+
+    def changed(self,eln_name:str,uid:str,rows:List[tuple]) -> List[tuple]:
+        """
+        返回新增或内容有变化的[(row,hash),...]，row为update_template生成的(addModule,add)
+        """
+        hashes = [self.hash(row) for row in rows]
+        known = self.known(eln_name,uid,[row[0][0]["name"] for row in rows])
+        return [(row,row_hash) for row,row_hash in zip(rows,hashes) if known.get(row[0][0]["name"]) != row_hash]
+
+    def record(self,eln_name:str,uid:str,rows:List[tuple]):
+        self.record_hashes(eln_name,uid,[(row[0][0]["name"],row_hash) for row,row_hash in rows])
+
+    def record_hashes(self,eln_name:str,uid:str,hashes:List[tuple]):
+        """按[(模块名,哈希),...]记录"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("""INSERT OR REPLACE INTO modules (eln,uid,module,hash,updated)
+                                       VALUES (?,?,?,?,?)""",
+                                   [(eln_name,uid,module,row_hash,now) for module,row_hash in hashes])
+
+    def forget(self,eln_name:str,uid:Union[str,None] = None):
+        with self._lock, self._conn:
+            if uid is None:
+                self._conn.execute("DELETE FROM modules WHERE eln=?",(eln_name,))
+            else:
+                self._conn.execute("DELETE FROM modules WHERE eln=? AND uid=?",(eln_name,uid))
+
+    def close(self):
+        self._conn.close()
+
+def eln_file_hash(path:str,chunk_size:int = 1 << 20) -> tuple:
+    """
+    分块读入同一缓冲区计算文件的SHA-256，返回(哈希,字节数)；内存占用与文件大小无关
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    size = 0
+    with open(path,"rb",buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            size += n
+    return digest.hexdigest(),size
+
+class eln_blob_registry():
+    """
+    物理所电子实验平台文件上传登记（SQLite）：按内容哈希记录已上传文件的引用，
+    并按(路径,大小,修改时间)缓存文件哈希，未改动的文件不重复计算
+    """
+    def __init__(self,
+                 path:Union[str,None] = None) -> None:
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"),".iop_eln","blobs.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS blobs (
+                                      server TEXT NOT NULL,
+                                      sha256 TEXT NOT NULL,
+                                      size INTEGER NOT NULL,
+                                      ref TEXT NOT NULL,
+                                      uploaded REAL NOT NULL,
+                                      PRIMARY KEY (server,sha256))""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                      path TEXT PRIMARY KEY,
+                                      size INTEGER NOT NULL,
+                                      mtime INTEGER NOT NULL,
+                                      sha256 TEXT NOT NULL)""")
+
+    def file_hash(self,path:str) -> tuple:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM files WHERE path=? AND size=? AND mtime=?",
+                                     (path,stat.st_size,stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0],stat.st_size
+        digest,size = eln_file_hash(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files (path,size,mtime,sha256) VALUES (?,?,?,?)",
+                               (path,size,stat.st_mtime_ns,digest))
+        return digest,size
+
+    def get(self,server:str,digest:str) -> Union[dict,None]:
+        with self._lock:
+            row = self._conn.execute("SELECT ref FROM blobs WHERE server=? AND sha256=?",(server,digest)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def record(self,server:str,digest:str,size:int,ref:dict):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO blobs (server,sha256,size,ref,uploaded) VALUES (?,?,?,?,?)",
+                               (server,digest,size,json.dumps(ref,ensure_ascii=False),time.time()))
+
+    def forget(self,server:str,digest:Union[str,None] = None):
+        with self._lock, self._conn:
+            if digest is None:
+                self._conn.execute("DELETE FROM blobs WHERE server=?",(server,))
+            else:
+                self._conn.execute("DELETE FROM blobs WHERE server=? AND sha256=?",(server,digest))
+
+    def close(self):
+        self._conn.close()
+
+class eln_export_cache():
+    """
+    物理所电子实验平台本地导出缓存（SQLite）：按(记录本,关键词,uid)缓存记录及上次导出的时间，
+    ttl内直接读取本地，过期后只用date_start导出新记录并按id合并；总大小超过max_bytes时淘汰最久未读的缓存
+    """
+    def __init__(self,
+                 path:Union[str,None] = None,
+                 ttl:float = 300.,
+                 max_bytes:int = 1 << 30,
+                 overlap:float = 600.) -> None:
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"),".iop_eln","export.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.overlap = overlap ### 本地与服务器时钟差的余量，重复记录按id合并
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                      key TEXT PRIMARY KEY,
+                                      high_water TEXT NOT NULL,
+                                      fetched REAL NOT NULL,
+                                      accessed REAL NOT NULL)""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS datasets (
+                                      key TEXT NOT NULL,
+                                      id TEXT NOT NULL,
+                                      body TEXT NOT NULL,
+                                      PRIMARY KEY (key,id))""")
+
+    def key(self,eln_name_list:List[str],keywords:list = None,uids:list = None) -> str:
+        return json.dumps([sorted(eln_name_list),
+                           None if keywords is None else sorted(keywords),
+                           None if uids is None else sorted(uids)],ensure_ascii=False)
+
+    def entry(self,key:str) -> Union[tuple,None]:
+        """返回(high_water,fetched)，没有缓存时返回None"""
+        with self._lock:
+            return self._conn.execute("SELECT high_water,fetched FROM entries WHERE key=?",(key,)).fetchone()
+
+    def fresh(self,key:str) -> bool:
+        entry = self.entry(key)
+        return entry is not None and time.time() - entry[1] < self.ttl
+
+    def merge(self,key:str,datasets,high_water:str,replace:bool = False):
+        ### datasets可能是正在下载的生成器：先在锁外取完并序列化，只有写入SQLite时持锁
+        rows = [(key,str(dataset.get("id",(dataset.get("uid"),dataset.get("title")))),
+                 json.dumps(dataset,ensure_ascii=False)) for dataset in datasets]
+        now = time.time()
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM datasets WHERE key=?",(key,))
+            self._conn.executemany("INSERT OR REPLACE INTO datasets (key,id,body) VALUES (?,?,?)",rows)
+            self._conn.execute("""INSERT OR REPLACE INTO entries (key,high_water,fetched,accessed)
+                                   VALUES (?,?,?,?)""",(key,high_water,now,now))
+        self.evict(keep=key)
+
+    def datasets(self,key:str) -> List[dict]:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE entries SET accessed=? WHERE key=?",(time.time(),key))
+            rows = self._conn.execute("SELECT body FROM datasets WHERE key=? ORDER BY rowid",(key,)).fetchall()
+        return [json.loads(body) for body, in rows]
+
+    def evict(self,keep:Union[str,None] = None):
+        with self._lock, self._conn:
+            sizes = self._conn.execute("""SELECT entries.key,COALESCE(SUM(LENGTH(datasets.body)),0)
+                                           FROM entries LEFT JOIN datasets ON entries.key=datasets.key
+                                           GROUP BY entries.key ORDER BY entries.accessed""").fetchall()
+            total = sum(size for _,size in sizes)
+            for key,size in sizes:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                self._conn.execute("DELETE FROM datasets WHERE key=?",(key,))
+                self._conn.execute("DELETE FROM entries WHERE key=?",(key,))
+                total -= size
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM datasets")
+            self._conn.execute("DELETE FROM entries")
+
+    def close(self):
+        self._conn.close()
+
+class eln_spool():
+    """
+    物理所电子实验平台上传日志（SQLite）：待上传的数据先写入磁盘并立即返回，由后台线程分批回放；
+    进程重启后未完成的数据会继续上传
+    """
+    def __init__(self,
+                 path:Union[str,None] = None,
+                 max_attempts:int = 10,
+                 backoff_max:float = 300.,
+                 lease:float = 600.) -> None:
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"),".iop_eln","spool.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,timeout=30,check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                      endpoint TEXT NOT NULL,
+                                      payload TEXT NOT NULL,
+                                      status TEXT NOT NULL DEFAULT 'pending',
+                                      attempts INTEGER NOT NULL DEFAULT 0,
+                                      error TEXT,
+                                      created REAL NOT NULL,
+                                      next_at REAL NOT NULL,
+                                      sync TEXT)""")
+            if "sync" not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN sync TEXT")
+            ### 发送中的数据其next_at为租约到期时间；租约过期说明发送方已退出，重新排队（至少上传一次）
+            self._conn.execute("UPDATE jobs SET status='pending' WHERE status='sending' AND next_at<=?",(time.time(),))
+
+    def append(self,endpoint:str,payload:dict) -> int:
+        now = time.time()
+        with self._lock, self._conn:
+            return self._conn.execute("INSERT INTO jobs (endpoint,payload,created,next_at) VALUES (?,?,?,?)",
+                                      (endpoint,json.dumps(payload,ensure_ascii=False,default=eln_json_default),now,now)).lastrowid
+
+    def claim(self,limit:int) -> List[tuple]:
+        """
+        取出最多limit条到期的数据并标记为发送中（租约lease秒，过期后其他回放方可重新取出），
+        返回[(id,endpoint,payload),...]
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute("""SELECT id,endpoint,payload FROM jobs
+                                          WHERE status IN ('pending','sending') AND next_at<=? ORDER BY id LIMIT ?""",
+                                      (now,limit)).fetchall()
+            self._conn.executemany("UPDATE jobs SET status='sending',next_at=? WHERE id=?",[(now + self.lease,row[0]) for row in rows])
+        return [(job_id,endpoint,json.loads(payload)) for job_id,endpoint,payload in rows]
+
+    def attach(self,job_id:int,sync:dict) -> str:
+        """
+        为数据附加上传成功后要写入同步索引的内容，返回该数据的当前状态；
+        已是done时不再附加，由调用方直接写入
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET sync=? WHERE id=? AND status!='done'",(json.dumps(sync,ensure_ascii=False),job_id))
+            return self._conn.execute("SELECT status FROM jobs WHERE id=?",(job_id,)).fetchone()[0]
+
+    def queued(self,eln_name:str,uid:str) -> Dict[str,str]:
+        """待上传与发送中的数据所附加的{模块名:哈希}"""
+        out = {}
+        with self._lock:
+            rows = self._conn.execute("""SELECT sync FROM jobs WHERE status IN ('pending','sending') AND sync IS NOT NULL
+                                          ORDER BY id""").fetchall()
+        for (sync,) in rows:
+            sync = json.loads(sync)
+            if sync["eln"] == eln_name and sync["uid"] == uid:
+                out.update(sync["modules"])
+        return out
+
+    def done(self,job_id:int) -> Union[dict,None]:
+        """标记上传成功，返回attach附加的内容"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status='done',error=NULL WHERE id=?",(job_id,))
+            sync = self._conn.execute("SELECT sync FROM jobs WHERE id=?",(job_id,)).fetchone()[0]
+        return None if sync is None else json.loads(sync)
+
+    def retry(self,job_id:int,error:str):
+        with self._lock, self._conn:
+            attempts = self._conn.execute("SELECT attempts FROM jobs WHERE id=?",(job_id,)).fetchone()[0] + 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            self._conn.execute("UPDATE jobs SET status=?,attempts=?,error=?,next_at=? WHERE id=?",
+                               (status,attempts,error,time.time() + min(self.backoff_max,2. ** attempts),job_id))
+
+    def next_at(self) -> float:
+        """最早可取出的时间，包括其他回放方发送中数据的租约到期时间"""
+        with self._lock:
+            out = self._conn.execute("SELECT MIN(next_at) FROM jobs WHERE status IN ('pending','sending')").fetchone()[0]
+        return time.time() if out is None else out
+
+    def counts(self) -> Dict[str,int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status,COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def failed(self) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute("SELECT id,endpoint,error FROM jobs WHERE status='failed' ORDER BY id").fetchall()
+
+    def requeue(self):
+        """将失败的数据重新排队"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status='pending',attempts=0,next_at=? WHERE status='failed'",(time.time(),))
+
+    def purge(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE status='done'")
+
+    def close(self):
+        self._conn.close()
+
+class eln_coalescer():
+    """
+    合并多次update_data：按(记录本,uid)缓存addModule/add，达到模块数或字节数上限、超过max_delay秒
+    或调用flush()时合并为一次update_json_data请求；每次调用返回Future，完成后得到该请求的状态
+    """
+    def __init__(self,
+                 client,
+                 max_modules:int = 100,
+                 max_bytes:Union[int,None] = None,
+                 max_delay:float = 1.) -> None:
+        self.client = client
+        self.max_modules = max_modules
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._buffers = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self.run,daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def add(self,
+            eln_name:str,
+            uid:str,
+            add_module:List[dict],
+            add_data:List[dict]) -> Future:
+        future = Future()
+        batch = None
+        size = len(json.dumps([add_module,add_data],default=eln_json_default)) if self.max_bytes is not None else 0
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("合并器已关闭！")
+            key = (eln_name,uid)
+            buffer = self._buffers.setdefault(key,{"modules":[],"add":[],"futures":[],"bytes":0,"since":time.monotonic()})
+            buffer["modules"] += add_module
+            buffer["add"] += add_data
+            buffer["futures"].append(future)
+            buffer["bytes"] += size
+            if len(buffer["modules"]) >= self.max_modules or (self.max_bytes is not None and buffer["bytes"] >= self.max_bytes):
+                batch = (key,self._buffers.pop(key))
+            self._cond.notify()
+        if batch is not None:
+            ### 达到上限时在调用线程中发送，生产者随之减速
+            self.send(*batch)
+        return future
+
+    def send(self,key:tuple,buffer:dict):
+        client = self.client
+        eln_name,uid = key
+        payload = client.update_json_data(eln_name=eln_name,
+                                          uid=uid,
+                                          addModule=buffer["modules"],
+                                          add=buffer["add"])
+        try:
+            if client.spool is not None:
+                status = client.spool_chunk(client._update_url,lambda start,stop: payload,0,0,len(buffer["futures"]))
+            else:
+                status = client.send_chunk(client._update_url,lambda start,stop: payload,0,0,len(buffer["futures"]))
+        except Exception as e:
+            for future in buffer["futures"]:
+                future.set_exception(e)
+            return
+        for future in buffer["futures"]:
+            if status["status"] in ("OK","spooled"):
+                future.set_result(status)
+            else:
+                future.set_exception(IOError(f"导入失败！{status['error']}"))
+
+    def run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [key for key,buffer in self._buffers.items() if now - buffer["since"] >= self.max_delay]
+                batches = [(key,self._buffers.pop(key)) for key in due]
+                if len(batches) == 0:
+                    wait = min([buffer["since"] + self.max_delay - now for buffer in self._buffers.values()],default=None)
+                    self._cond.wait(wait)
+                    continue
+            for batch in batches:
+                self.send(*batch)
+
+    def flush(self):
+        with self._cond:
+            batches = list(self._buffers.items())
+            self._buffers = {}
+        for batch in batches:
+            self.send(*batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+def eln_func_hash(func) -> str:
+    """
+    模板或函数的内容哈希：eln_template按fields，函数按字节码与常量，用于判断断点是否仍适用
+    """
+    if isinstance(func,eln_template):
+        text = json.dumps(func.fields,sort_keys=True,ensure_ascii=False,default=str)
+    elif isinstance(func,str):
+        text = func
+    else:
+        code = getattr(func,"__code__",None)
+        if code is None:
+            text = f"{type(func).__module__}.{type(func).__qualname__}"
+        else:
+            text = f"{code.co_code.hex()}|{code.co_consts!r}|{code.co_names!r}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class eln_checkpoint():
+    """
+    断点记录：保存已确认上传的块编号，任务中断后重新运行时跳过这些块
+    """
+    def __init__(self,
+                 path:str,
+                 key:dict) -> None:
+        self.path = path
+        self.key = key
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path,encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("key") != key:
+                raise ValueError(f"断点文件{path}与本次任务不一致！")
+            self.done = set(saved.get("done",[]))
+
+    def __contains__(self,chunk:int) -> bool:
+        return chunk in self.done
+
+    def add(self,chunk:int):
+        with self._lock:
+            self.done.add(chunk)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp,"w",encoding="utf-8") as f:
+                json.dump({"key":self.key,"done":sorted(self.done)},f,ensure_ascii=False)
+            os.replace(tmp,self.path)
+
+class eln_json_stream():
+    """
+    增量解析JSON对象：逐个产出key字段数组中的元素，其余顶层字段存入fields
+    """
+    def __init__(self,
+                 chunks,
+                 key:str = "dataset") -> None:
+        self.chunks = iter(chunks)
+        self.key = key
+        self.fields = {}
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._pending = [] ### 已读入、尚未并入缓冲区的文本块
+        self._pending_size = 0
+        self._eof = False
+
+    def fill(self) -> bool:
+        """读入一块暂存到_pending，由join统一并入缓冲区，避免每块都复制未解析的部分"""
+        if self._eof:
+            return False
+        try:
+            text = self._utf8.decode(next(self.chunks))
+        except StopIteration:
+            text = self._utf8.decode(b"",final=True)
+            self._eof = True
+        self._pending.append(text)
+        self._pending_size += len(text)
+        return True
+
+    def join(self):
+        if len(self._pending) > 0:
+            self._buf = self._buf[self._pos:] + "".join(self._pending)
+            self._pos = 0
+            self._pending = []
+            self._pending_size = 0
+
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self.fill():
+                raise ValueError("JSON数据不完整！")
+            self.join()
+
+    def take(self,chars:str) -> str:
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"JSON格式错误：位置{self._pos}应为{chars}而不是{char}")
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                out,end = self._decoder.raw_decode(self._buf,self._pos)
+                ### 数字可能被分块截断（如“1.”“2e”会被解析为更短的数字），只有后面是分隔符或输入已结束时才接受
+                if end < len(self._buf) and self._buf[end] in " \t\r\n,:]}":
+                    self._pos = end
+                    return out
+                if self._eof:
+                    if end == len(self._buf):
+                        self._pos = end
+                        return out
+                    raise ValueError(f"JSON格式错误：位置{end}的值后面不是分隔符")
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            ### 缓冲区按倍数增长并只合并一次，大对象的解析与复制总量与其大小成正比
+            target = len(self._buf) - self._pos
+            while self._pending_size < target and self.fill():
+                pass
+            self.join()
+
+    def __iter__(self):
+        self.take("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.take(":")
+            if key == self.key:
+                self.take("[")
+                if self.peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self.value()
+                        if self.take(",]") == "]":
+                            break
+            else:
+                self.fields[key] = self.value()
+            if self.take(",}") == "}":
+                return
+
+def eln_iter_modules(datasets):
+    """
+    导出记录的统一遍历：逐个产出(记录,模块,数据项列表)，跳过没有数据或数据不是列表的模块
+    """
+    for dataset in datasets:
+        for module in dataset.get("data") or []:
+            entries = module.get("data") or []
+            if isinstance(entries,list):
+                yield dataset,module,entries
+
+class eln_export_sink():
+    """
+    导出数据的列式写入：将记录/模块/数据项展开为长表，按记录本分区（<path>/eln=<记录本>/）
+    写入Parquet或Arrow IPC文件，数据项的值按类型分到text/number/bool/json列。
+    数据随写随清空缓冲，内存占用与导出总量无关。
+    mode为“overwrite”时关闭后删除本次写入的分区中以前的文件（未写入的分区不变），为“append”时保留
+    """
+    columns = ["eln","dataset_id","title","uid","date","module_uid","module_name","module_type",
+               "name","type","text","number","bool","json"]
+
+    def __init__(self,
+                 path:str,
+                 format:str = "parquet",
+                 batch_rows:int = 65536,
+                 mode:str = "overwrite") -> None:
+        if format not in ["parquet","arrow"]:
+            raise ValueError("format应为“parquet”或“arrow”！")
+        if mode not in ["overwrite","append"]:
+            raise ValueError("mode应为“overwrite”或“append”！")
+        self.path = path
+        self.format = format
+        self.mode = mode
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.files = []
+        self._buffers = {} ### 记录本 -> 各列列表
+        self._writers = {} ### 记录本 -> 打开的写入器，同一次导出追加到同一文件
+        self._stamp = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}" ### 每次导出写新文件，写完后再按mode替换旧文件
+        pa = eln_pyarrow()
+        self.schema = pa.schema([(column,pa.float64() if column == "number" else (pa.bool_() if column == "bool" else pa.string()))
+                                 for column in self.columns])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,*args):
+        ### 导出中途出错时保留以前的文件
+        self.close(replace = exc_type is None)
+
+    def write(self,datasets) -> int:
+        """追加一批记录，返回写入的数据项行数"""
+        n = 0
+        for dataset,module,entries in eln_iter_modules(datasets):
+            eln_name = dataset.get("eln_name")
+            buffer = self._buffers.get(eln_name)
+            if buffer is None:
+                buffer = self._buffers[eln_name] = {column:[] for column in self.columns}
+            head = (eln_name,
+                    None if dataset.get("id") is None else str(dataset.get("id")),
+                    dataset.get("title"),
+                    dataset.get("uid"),
+                    dataset.get("date"))
+            m = len(entries)
+            for column,value in zip(("eln","dataset_id","title","uid","date"),head):
+                buffer[column].extend([value] * m)
+            for column,key in (("module_uid","uid"),("module_name","name"),("module_type","type")):
+                buffer[column].extend([module.get(key)] * m)
+            for entry in entries:
+                value = entry.get("data")
+                buffer["name"].append(entry.get("name"))
+                buffer["type"].append(entry.get("type"))
+                buffer["text"].append(value if isinstance(value,str) else None)
+                buffer["number"].append(float(value) if isinstance(value,(int,float)) and not isinstance(value,bool) else None)
+                buffer["bool"].append(value if isinstance(value,bool) else None)
+                buffer["json"].append(json.dumps(value,ensure_ascii=False) if isinstance(value,(list,dict)) else None)
+            n += m
+            if len(buffer["name"]) >= self.batch_rows:
+                self.flush(eln_name)
+        self.rows += n
+        return n
+
+    def writer(self,eln_name:str):
+        writer = self._writers.get(eln_name)
+        if writer is None:
+            folder = os.path.join(self.path,f"eln={url_quote(str(eln_name),safe='')}")
+            os.makedirs(folder,exist_ok=True)
+            path = os.path.join(folder,f"part-{self._stamp}.{self.format}")
+            if self.format == "parquet":
+                writer = eln_pyarrow("parquet").ParquetWriter(path,self.schema)
+            else:
+                ### 不压缩，读取时可直接内存映射
+                writer = eln_pyarrow("ipc").new_file(path,self.schema)
+            self._writers[eln_name] = writer
+            self.files.append(path)
+        return writer
+
+    def flush(self,eln_name = None):
+        for name in list(self._buffers) if eln_name is None else [eln_name]:
+            buffer = self._buffers.pop(name)
+            if len(buffer["name"]) > 0:
+                self.writer(name).write_table(eln_pyarrow().table(buffer,schema=self.schema))
+
+    def close(self,replace:bool = True):
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        if replace and self.mode == "overwrite":
+            for file in self.files:
+                folder = os.path.dirname(file)
+                for old in glob.glob(os.path.join(glob.escape(folder),"part-*")):
+                    if old not in self.files:
+                        os.remove(old)
+
+def eln_read_export(path:str,
+                    columns:Union[List[str],None] = None,
+                    eln_name:Union[str,List[str],None] = None,
+                    as_arrow:bool = False):
+    """
+    读取eln_export_sink写入的目录：Arrow IPC文件内存映射零拷贝读取，Parquet以memory_map读取且只解码所需列；
+    columns为读取的列，eln_name只读取对应记录本的分区
+    """
+    pa,parquet,ipc = eln_pyarrow(),eln_pyarrow("parquet"),eln_pyarrow("ipc")
+    folders = ["eln=*"] if eln_name is None else [f"eln={url_quote(str(name),safe='')}" for name in ([eln_name] if isinstance(eln_name,str) else eln_name)]
+    files = sorted(file for folder in folders for pattern in ("*.parquet","*.arrow")
+                   for file in glob.glob(os.path.join(glob.escape(path),folder,pattern)))
+    tables = []
+    for file in files:
+        if file.endswith(".arrow"):
+            table = ipc.open_file(pa.memory_map(file)).read_all()
+            tables.append(table if columns is None else table.select(columns))
+        else:
+            tables.append(parquet.read_table(file,columns=columns,memory_map=True))
+    if len(tables) == 0:
+        table = pa.table({column:[] for column in (eln_export_sink.columns if columns is None else columns)})
+    else:
+        table = pa.concat_tables(tables)
+    return table if as_arrow else table.to_pandas()
 
 class eln_Module():
     """
@@ -145,19 +1418,158 @@ class eln_table_Module(eln_Module):
                           List[bool]:"布尔值列"
                           }
     
+    def column_type(self,entry_data) -> Union[str,None]:
+        ### NumPy数组与pandas序列按dtype判断列类型，列表按元素类型判断；无法判断时返回None
+        if (np.loaded and isinstance(entry_data,np.ndarray)) or (pd.loaded and isinstance(entry_data,pd.Series)):
+            if entry_data.ndim != 1:
+                return None
+            kind = entry_data.dtype.kind
+            return "布尔值列" if kind == "b" else ("数字列" if kind in "iuf" else "文本列")
+        if isinstance(entry_data,(list,tuple)):
+            bools,numbers = ((bool,np.bool_),(int,float,np.integer,np.floating)) if np.loaded else ((bool,),(int,float))
+            if len(entry_data) > 0 and all(isinstance(value,bools) for value in entry_data):
+                return "布尔值列"
+            if len(entry_data) > 0 and all(isinstance(value,numbers) and not isinstance(value,bool) for value in entry_data):
+                return "数字列"
+            if all(isinstance(value,str) for value in entry_data):
+                return "文本列"
+            return None
+        return self.type_dict.get(type(entry_data))
+
     def add(self,
             entry_data:Union[
                              List[str], ### 文本列/日期列/时间列/文件上传列/下拉选框列
                              List[float], ### 数字列
                              List[bool], ### 布尔值列
+                             np.ndarray, ### 一维数组，按dtype对应数字列/布尔值列/文本列
+                             pd.Series, ### 同上，不保留索引
                              ],
             entry_name:str = None,
             ):
-        if type(entry_data) not in self.type_dict.keys():
+        column_type = self.column_type(entry_data)
+        if column_type is None:
             raise TypeError(f"表格模块只能导入文本列/日期列/时间列/文件上传列/下拉选框列/数字列/布尔值列而不是{type(entry_data)}")
         if entry_name is None:
-            entry_name = self.type_dict[type(entry_data)] + str(datetime.datetime.now())
-        self.data[entry_name] = entry_data
+            entry_name = column_type + str(datetime.datetime.now())
+        self.data[entry_name] = self.column_values(entry_data)
+
+    def column_values(self,entry_data):
+        """
+        转为标准库json与orjson序列化结果一致的列：日期时间转为“年-月-日 时:分:秒”字符串，
+        NaN/NaT/缺失值转为None；没有缺失值的数值/布尔列不复制数据
+        """
+        if pd.loaded and isinstance(entry_data,pd.Series):
+            if entry_data.dtype.kind == "M":
+                entry_data = entry_data.dt.strftime("%Y-%m-%d %H:%M:%S")
+            elif entry_data.dtype.kind == "m":
+                entry_data = entry_data.astype(object).map(lambda value: None if pd.isna(value) else str(value))
+            entry_data = entry_data.to_numpy()
+        if isinstance(entry_data,(list,tuple)):
+            return [None if isinstance(value,float) and value != value else value for value in entry_data]
+        kind = entry_data.dtype.kind
+        if kind == "b" or kind in "iu":
+            return entry_data
+        if kind == "f":
+            missing = np.isnan(entry_data)
+            if not missing.any():
+                return entry_data
+            out = entry_data.astype(object)
+        elif kind == "M":
+            missing = np.isnat(entry_data)
+            out = np.char.replace(np.datetime_as_string(entry_data.astype("datetime64[s]")),"T"," ").astype(object)
+        elif kind == "m":
+            missing = np.isnat(entry_data)
+            out = entry_data.astype(str).astype(object)
+        else:
+            out = entry_data.astype(object)
+            missing = pd.isna(out) if pd.loaded else np.array([value is None or value != value for value in out],dtype=bool)
+        out[missing] = None
+        return out
+
+class eln_richtext():
+    """
+    富文本渲染：HTML转义，以及链接、加粗、字号、标题、段落模板；整列用向量化字符串操作处理，
+    转义结果按内容摘要存入有上限的LRU缓存，重复出现的文本只转义一次
+    """
+    escape_table = [("&","&amp;"),("<","&lt;"),(">","&gt;"),('"',"&quot;"),("'","&#x27;")] ### &必须最先替换
+
+    def __init__(self,
+                 max_cache:int = 100000) -> None:
+        self.max_cache = max_cache
+        self.cache = collections.OrderedDict() ### 原文摘要 -> 转义结果，按最近使用排序
+        self._lock = threading.Lock()
+
+    def digest(self,text:str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"),digest_size=16).digest()
+
+    def lookup(self,keys:List[bytes]) -> list:
+        """按摘要取缓存，没有的为None"""
+        out = []
+        with self._lock:
+            for key in keys:
+                value = self.cache.get(key)
+                if value is not None:
+                    self.cache.move_to_end(key)
+                out.append(value)
+        return out
+
+    def remember(self,update:dict):
+        with self._lock:
+            for key,value in update.items():
+                self.cache[key] = value
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cache:
+                self.cache.popitem(last=False)
+
+    def escape_text(self,text:str) -> str:
+        key = self.digest(text)
+        out = self.lookup([key])[0]
+        if out is None:
+            out = text
+            for old,new in self.escape_table:
+                out = out.replace(old,new)
+            self.remember({key:out})
+        return out
+
+    def escape(self,values:pd.Series) -> pd.Series:
+        """转义整列，缺失值保持为None；每个不同的文本只查一次缓存，缓存中没有的一起转义"""
+        mask = values.notna()
+        codes,unique = pd.factorize(values[mask].astype(str).astype(object))
+        unique = np.asarray(unique,dtype=object)
+        keys = [self.digest(text) for text in unique]
+        found = self.lookup(keys)
+        missing = [i for i,value in enumerate(found) if value is None]
+        if len(missing) > 0:
+            escaped = pd.Series(unique[missing],dtype=object)
+            for old,rep in self.escape_table:
+                escaped = escaped.str.replace(old,rep,regex=False)
+            for i,value in zip(missing,escaped.tolist()):
+                found[i] = value
+            self.remember({keys[i]:found[i] for i in missing})
+        ### 按位置写回，索引有重复时也不会错位
+        result = np.full(len(values),None,dtype=object)
+        result[mask.to_numpy()] = np.asarray(found,dtype=object)[codes] if len(found) > 0 else []
+        return pd.Series(result,index=values.index,dtype=object)
+
+    ### 以下模板的text为已渲染的HTML，不再转义；链接地址会转义
+    def link(self,text:pd.Series,url:pd.Series,target:str = "_blank") -> pd.Series:
+        url = self.escape(url)
+        return '<a href="' + url + '" title="' + url + f'" target="{target}">' + text + "</a>"
+
+    def bold(self,text:pd.Series) -> pd.Series:
+        return "<b>" + text + "</b>"
+
+    def size(self,text:pd.Series,size:Union[int,str]) -> pd.Series:
+        size = f"{size}px" if isinstance(size,int) else size
+        return f'<font style="font-size:{size}">' + text + "</font>"
+
+    def heading(self,text:pd.Series,level:int = 3) -> pd.Series:
+        return f"<h{level}>" + text + f"</h{level}>"
+
+    def paragraph(self,text:pd.Series,align:Union[str,None] = None) -> pd.Series:
+        return ("<p>" if align is None else f'<p align="{align}">') + text + "</p>"
+
+eln_html = eln_richtext() ### 模块级共享缓存
 
 class eln_richtext_Module(eln_Module):
     """富文本模块"""
@@ -170,9 +1582,12 @@ class eln_richtext_Module(eln_Module):
     def add(self,
             entry_data:str, ### 文本项
             entry_name:str = None,
+            escape:bool = False, ### 按纯文本转义HTML
             ):
         if type(entry_data) != str:
             raise TypeError(f"富文本模块只能导入文本项而不是{type(entry_data)}")
+        if escape:
+            entry_data = eln_html.escape_text(entry_data)
         if entry_name is None:
             entry_name = self.type_dict[type(entry_data)] + str(datetime.datetime.now())
         self.data[entry_name] = entry_data
@@ -190,6 +1605,129 @@ class eln_images_Module(eln_Module):
             ):
         self.data.append(entry_data)
 
+def eln_lttb(x:np.ndarray,y:np.ndarray,points:int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets降采样，返回保留点的下标；首尾两点总是保留，每个桶内的面积计算向量化
+    """
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x,y = np.asarray(x,dtype=float),np.asarray(y,dtype=float)
+    x,y = x - x[0],y - y[0] ### 面积只与差值有关，平移后累加和不丢精度（如毫秒时间戳）
+    edges = np.linspace(1,n - 1,points - 1).astype(np.int64) ### points-2个桶，不含首尾两点
+    ### 下一个桶的平均点，用累加和一次算出；最后一个桶的下一个“桶”是末点
+    starts = edges[1:]
+    stops = np.append(edges[2:],n)
+    x_sum,y_sum = np.concatenate(([0.],np.cumsum(x))),np.concatenate(([0.],np.cumsum(y)))
+    next_x = (x_sum[stops] - x_sum[starts]) / (stops - starts)
+    next_y = (y_sum[stops] - y_sum[starts]) / (stops - starts)
+    out = np.empty(points,dtype=np.int64)
+    out[0],out[-1] = 0,n - 1
+    a = 0
+    for i in range(points - 2):
+        start,stop = edges[i],edges[i + 1]
+        bx,by = x[start:stop],y[start:stop]
+        area = np.abs((x[a] - next_x[i]) * (by - y[a]) - (x[a] - bx) * (next_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def eln_minmax(x:np.ndarray,y:np.ndarray,points:int) -> np.ndarray:
+    """
+    min/max分桶降采样：每个桶保留最小值与最大值两点，返回按原顺序排列的下标；全部向量化
+    """
+    n = len(y)
+    if points >= n or points < 2:
+        return np.arange(n)
+    y = np.asarray(y,dtype=float)
+    starts = np.linspace(0,n,max(1,points // 2) + 1).astype(np.int64)[:-1]
+    bucket = np.repeat(np.arange(len(starts)),np.diff(np.append(starts,n)))
+    out = []
+    for reduce in (np.minimum,np.maximum):
+        hit = np.flatnonzero(y == reduce.reduceat(y,starts)[bucket])
+        ### 每个桶取第一个命中的下标
+        out.append(hit[np.unique(bucket[hit],return_index=True)[1]])
+    return np.unique(np.concatenate(out + [[0,n - 1]]))
+
+class eln_echarts_Module(eln_Module):
+    """图表模块：module_data为ECharts的option，数值序列按目标点数降采样后写入"""
+    def __init__(self,
+                 module_name: str,
+                 module_data: Union[dict,None] = None, ### ECharts option
+                 module_type: str = "echarts") -> None:
+        super().__init__(module_name, module_type, {} if module_data is None else module_data)
+        self.module_data.setdefault("tooltip",{"trigger":"axis"})
+        self.module_data.setdefault("legend",{})
+        self.module_data.setdefault("xAxis",{"type":"value"})
+        self.module_data.setdefault("yAxis",{"type":"value"})
+        self.module_data.setdefault("series",[])
+        self.full_data = {} ### 序列名 -> 原始(x,y)，用于附加全分辨率文件
+        self.sample_dict = {"lttb":eln_lttb,"minmax":eln_minmax}
+
+    def add(self,
+            entry_data:Union[np.ndarray,pd.Series,List[float]], ### y
+            entry_name:str = None,
+            x:Union[np.ndarray,pd.Series,pd.Index,List[float],None] = None,
+            points:Union[int,None] = 1000,
+            method:str = "lttb",
+            series_type:str = "line",
+            attach:bool = False,
+            ):
+        """
+        添加一条数值序列：x默认为序号，datetime类型的x以毫秒时间戳写入并使用时间轴；
+        丢弃非有限值后用method（“lttb”或“minmax”）降采样到points个点，points为None时不降采样；
+        attach为True时保留全分辨率数据，由files()上传为文件并生成文件项
+        """
+        if method not in self.sample_dict.keys():
+            raise ValueError("降采样方法应为“lttb”或“minmax”！")
+        if entry_name is None:
+            entry_name = getattr(entry_data,"name",None) or f"series{len(self.module_data['series'])}"
+        y = np.asarray(entry_data,dtype=float)
+        x = np.arange(len(y)) if x is None else np.asarray(x)
+        if len(x) != len(y):
+            raise ValueError("x与y的长度不一致！")
+        if x.dtype.kind == "M":
+            x = x.astype("datetime64[ms]").astype(np.int64)
+            self.module_data["xAxis"]["type"] = "time"
+        keep = np.isfinite(y) & np.isfinite(x)
+        x,y = x[keep],y[keep]
+        index = np.arange(len(y)) if points is None else self.sample_dict[method](x,y,points)
+        self.module_data["series"].append({
+                                           "name":str(entry_name),
+                                           "type":series_type,
+                                           "showSymbol":False,
+                                           "data":np.column_stack((x[index],y[index]))
+                                           })
+        if attach:
+            self.full_data[str(entry_name)] = (x,y)
+
+    def add_frame(self,
+                  data_in:pd.DataFrame,
+                  x:Union[str,None] = None,
+                  columns:Union[List[str],None] = None,
+                  **kwargs):
+        """按列添加序列：x为横轴列名，默认使用索引；columns默认为其余全部数值列"""
+        x_data = data_in.index if x is None else data_in[x]
+        if columns is None:
+            columns = [column for column in data_in.select_dtypes("number").columns if column != x]
+        for column in columns:
+            self.add(data_in[column],entry_name=column,x=x_data,**kwargs)
+
+    def files(self,client,module_name:Union[str,None] = None) -> List[dict]:
+        """
+        将全分辨率数据写成临时CSV文件并用client.upload_file上传，返回引用文件地址的文件项（add数据），
+        默认写入本模块；请求体中只有文件地址，不含数据本身
+        """
+        module_name = self.name if module_name is None else module_name
+        out = []
+        with tempfile.TemporaryDirectory() as folder:
+            for i,(name,(x,y)) in enumerate(self.full_data.items()):
+                path = os.path.join(folder,f"series{i}.csv")
+                pd.DataFrame({"x":x,"y":y}).to_csv(path,index=False)
+                ref = client.upload_file(path,f"{name}.csv")
+                out.append(client.add_data(module_name,"file",ref["url"],ref["name"]))
+        return out
+
 class eln_data():
     """
     物理所电子实验平台数据模块基本类
@@ -269,8 +1807,9 @@ class eln_richtext_data(eln_data):
                  module_name: str, 
                  data: str,
                  data_type: str = "richtext", 
-                 data_name: str = None):
-        super().__init__(module_name,data,data_type,data_name)
+                 data_name: str = None,
+                 escape: bool = False): ### 按纯文本转义HTML
+        super().__init__(module_name,eln_html.escape_text(data) if escape and isinstance(data,str) else data,data_type,data_name)
     
 class eln_bool_data(eln_data):
     """布尔值型数据"""
@@ -281,26 +1820,181 @@ class eln_bool_data(eln_data):
                  data_name: str = None):
         super().__init__(module_name,data,data_type,data_name)
     
+class eln_template():
+    """
+    声明式列映射模板，代替逐行调用的data_func：
+    fields = [
+              {"column":列名,"data name":数据名,"data type":数据类型},
+              {"format":'<a href="{url}">{title}</a>',"data name":数据名,"data type":数据类型},
+              {"column":"title","link":"url","bold":True,"size":24,"align":"center",
+               "data name":数据名,"data type":"richtext"},
+             ]
+    对整张表只校验一次，并按列批量生成update_json_data所需的add数据。
+    富文本项默认转义HTML（format中只转义代入的值），已是HTML的列设置"escape":False；
+    link/bold/size/heading/align依次包裹转义后的内容
+    """
+    data_types = ["text","number","file","date","time","richtext","bool"]
+
+    def __init__(self,
+                 fields:List[dict]) -> None:
+        self.fields = []
+        for field in fields:
+            if field["data type"] not in self.data_types:
+                raise TypeError("只能导入“文本”、“数字”、“文件”、“日期”、“时间”、“富文本”和“布尔值”！")
+            if "column" not in field and "format" not in field:
+                raise ValueError(f"模板项{field['data name']}需要指定column或format！")
+            self.fields.append(dict(field))
+
+    def columns(self) -> List[str]:
+        out = []
+        for field in self.fields:
+            if "format" in field:
+                out += [name for _,name,_,_ in string.Formatter().parse(field["format"]) if name]
+            else:
+                out.append(field["column"])
+            if field.get("link"):
+                out.append(field["link"])
+        return list(dict.fromkeys(out))
+
+    def validate(self,data_in:pd.DataFrame):
+        missing = [column for column in self.columns() if column not in data_in.columns]
+        if len(missing) > 0:
+            raise KeyError(f"数据中没有模板所需的列：{missing}")
+
+    def render(self,field:dict,data_in:pd.DataFrame) -> pd.Series:
+        escape = field.get("escape",field["data type"] == "richtext")
+        if "format" not in field:
+            out = data_in[field["column"]]
+            return self.decorate(field,eln_html.escape(out) if escape else out,data_in)
+        parts = list(string.Formatter().parse(field["format"]))
+        if any(spec or conversion for _,name,spec,conversion in parts if name):
+            ### 带格式说明符时逐行格式化，只转义字符串值
+            columns = self.columns()
+            text = lambda value: eln_html.escape_text(value) if escape and isinstance(value,str) else value
+            return self.decorate(field,
+                                 pd.Series([field["format"].format(**{column:text(value) for column,value in zip(columns,values)})
+                                            for values in zip(*[data_in[column].tolist() for column in columns])],
+                                           index=data_in.index,dtype=object),
+                                 data_in)
+        out = pd.Series("",index=data_in.index,dtype=object)
+        for literal,name,_,_ in parts:
+            if literal:
+                out = out + literal
+            if name:
+                value = data_in[name].astype(str)
+                out = out + (eln_html.escape(value) if escape else value)
+        return self.decorate(field,out,data_in)
+
+    def decorate(self,field:dict,out:pd.Series,data_in:pd.DataFrame) -> pd.Series:
+        if not any(field.get(key) for key in ("link","bold","size","heading","align")):
+            return out
+        mask = out.notna()
+        text = out.astype(object).where(mask,"").astype(str)
+        if field.get("link"):
+            text = eln_html.link(text,data_in[field["link"]].fillna("").astype(str))
+        if field.get("bold"):
+            text = eln_html.bold(text)
+        if field.get("size"):
+            text = eln_html.size(text,field["size"])
+        if field.get("heading"):
+            text = eln_html.heading(text,field["heading"])
+        if field.get("align"):
+            text = eln_html.paragraph(text,field["align"])
+        return text.where(mask,None) ### 缺失值保持为缺失
+
+    def values(self,data_in:pd.DataFrame) -> List[list]:
+        """每个模板项对应一列Python原生值，缺失值为None"""
+        self.validate(data_in)
+        out = []
+        for field in self.fields:
+            column = self.render(field,data_in)
+            out.append(column.astype(object).where(column.notna(),None).tolist())
+        return out
+
+    def rows(self,
+             module_name:List[str],
+             module_type:List[str],
+             data_in:pd.DataFrame) -> List[tuple]:
+        columns = self.values(data_in)
+        out = []
+        for i,values in enumerate(zip(*columns) if len(columns) > 0 else [()] * len(data_in)):
+            out.append((
+                        [{"name":module_name[i],"type":module_type[i]}],
+                        [{"module":module_name[i],"type":field["data type"],"name":field["data name"],"data":value}
+                         for field,value in zip(self.fields,values)]
+                       ))
+        return out
+
+    def __call__(self,data:pd.Series) -> List[dict]:
+        ### 兼容data_func接口，可直接用于update_data
+        values = self.values(data.to_frame().T)
+        return [{"data type":field["data type"],"data name":field["data name"],"data":value[0]}
+                for field,value in zip(self.fields,values)]
+
 class eln():
     """
     物理所电子实验平台数据传输类
     """
-    def __init__(self):
+    def __init__(self,
+                 pool_size:int = 10,
+                 timeout:Union[float,tuple,None] = None,
+                 max_retries:int = 3,
+                 backoff_factor:float = 0.5,
+                 transport:Union[eln_transport,None] = None,
+                 token_store:Union[eln_token_store,bool,None] = True,
+                 sync_index:Union[eln_sync_index,None] = None,
+                 export_cache:Union[eln_export_cache,None] = None,
+                 base_url:Union[str,None] = None,
+                 token_url:Union[str,None] = None,
+                 metrics:Union[eln_metrics,None] = None,
+                 spool:Union[eln_spool,None] = None,
+                 limiter:Union[eln_limiter,bool,None] = None,
+                 json_backend:str = "json",
+                 blob_registry:Union[eln_blob_registry,None] = None,
+                 upload_url:Union[str,None] = None,
+                 upload_field:str = "url"):
         self.__username = os.getenv("eln_username")
         self.__password = os.getenv("eln_password")
-        self._AccessToken_url = "https://in.iphy.ac.cn/open/tokens2.php"
+        self._base_url = base_url or os.getenv("eln_base_url","https://eln.iphy.ac.cn:61263/open_eln")
+        self.transport = eln_transport(pool_size=pool_size,
+                                       timeout=timeout,
+                                       max_retries=max_retries,
+                                       backoff_factor=backoff_factor,
+                                       metrics=metrics,
+                                       json_backend=json_backend) if transport is None else transport
+        if metrics is not None:
+            self.transport.metrics = metrics
+        if limiter is not None and limiter is not False:
+            self.transport.limiter = eln_limiter(max_limit=self.transport.pool_size) if limiter is True else limiter
+        self.metrics = self.transport.metrics
+        self.token_store = eln_token_store() if token_store is True else (token_store or None)
+        self.sync_index = sync_index
+        self.export_cache = export_cache
+        self.spool = spool
+        self.blob_registry = blob_registry
+        self._blob_lock = threading.Lock()
+        self._blob_inflight = {} ### 内容哈希 -> 正在上传的Future，同一内容并发时只上传一次
+        self.coalescer = None
+        self._spool_thread = None
+        self._spool_stop = threading.Event()
+        self._token_lock = threading.Lock()
+        self._AccessToken_url = token_url or os.getenv("eln_token_url","https://in.iphy.ac.cn/open/tokens2.php")
         self._elns_url = self.get_url('elns')
         self._search_url = self.get_url('search')
         self._import_url = self.get_url('import')
         self._export_url = self.get_url('export')
         self._update_url = self.get_url('update')
+        ### 实验性：平台没有公开的文件上传接口，需按实际服务配置地址与响应中的文件地址字段
+        self._upload_url = upload_url or os.getenv("eln_upload_url")
+        self._upload_field = upload_field
         self._headers_url = 'application/x-www-form-urlencoded'
         self._headers_json = 'application/json'
         self.module_dict = {
                             "form":eln_form_Module,
                             "table":eln_table_Module,
                             "images":eln_images_Module,
-                            "richtext":eln_richtext_Module
+                            "richtext":eln_richtext_Module,
+                            "echarts":eln_echarts_Module,
                             }
         self.data_dict = {
                           "text":eln_text_data,
@@ -312,12 +2006,29 @@ class eln():
                           "bool":eln_bool_data,
                           }
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.stop_spool()
+        self.transport.close()
+
     def get_url(self,name:str)->str:
-        return f"https://eln.iphy.ac.cn:61263/open_eln/eln_api_{name}.php"
+        return f"{self._base_url.rstrip('/')}/eln_api_{name}.php"
 
-    def get_AccessToken(self):
-        response = requests.post(
+    def timed(self,name:str,**fields):
+        ### 未设置metrics时不计时
+        return contextlib.nullcontext() if self.metrics is None else self.metrics.timer(name,**fields)
+
+    def fetch_AccessToken(self) -> tuple:
+        if self.metrics is not None:
+            self.metrics.event("login")
+        response = self.transport.post(
                                  url=self._AccessToken_url,
+                                 idempotent=True,
                                  data={
                                        "username":self.__username,
                                        "password":self.__password
@@ -327,14 +2038,40 @@ class eln():
                                             'Authorization':'refreshToken'
                                            }
                                 )
-        self._token = response.json()["access"]["token"]
-    
+        access = eln_response_json(response)["access"]
+        ttl = self.token_store.ttl if self.token_store is not None else 3600.
+        return access["token"],time.time() + float(access.get("expires_in",ttl))
+
+    def get_AccessToken(self):
+        ### 重新登录；使用Token缓存时，若其他进程已刷新则直接复用
+        with self._token_lock:
+            if self.token_store is None:
+                self._token,self._token_expires = self.fetch_AccessToken()
+            else:
+                self._token,self._token_expires = self.token_store.get(url=self._AccessToken_url,
+                                                                       username=self.__username,
+                                                                       fetch=self.fetch_AccessToken,
+                                                                       stale=getattr(self,'_token',None))
+
+    def token_valid(self) -> bool:
+        margin = self.token_store.refresh_margin if self.token_store is not None else 300.
+        return getattr(self,'_token_expires',0) - margin > time.time()
+
     def refresh_AccessToken(self):
-        if not hasattr(self,'_token'):
-            self.get_AccessToken()
+        if self.token_valid():
+            return
+        with self._token_lock:
+            if self.token_valid():
+                return
+            if self.token_store is None:
+                self._token,self._token_expires = self.fetch_AccessToken()
+            else:
+                self._token,self._token_expires = self.token_store.get(url=self._AccessToken_url,
+                                                                       username=self.__username,
+                                                                       fetch=self.fetch_AccessToken)
 
     def respose_status(self,response):
-        errcode = response.json()['errcode']
+        errcode = eln_response_json(response)['errcode']
         if errcode == 0:
             return 'OK'
         elif errcode == 1:
@@ -344,6 +2081,8 @@ class eln():
         elif errcode == 3:
             raise IOError("服务器原因错误!")
         elif errcode == "refresh":
+            if self.metrics is not None:
+                self.metrics.event("refresh")
             self.get_AccessToken()
             return "refresh"
 
@@ -352,9 +2091,12 @@ class eln():
                     content_type:str,
                     #is_need_data:bool = False,
                     **kwargs):
+        ### 导入与更新重复发送会产生重复数据
+        idempotent = url not in (self._import_url,self._update_url)
         if content_type == 'application/json':
-            return requests.post(
+            return self.transport.post(
                                  url = url,
+                                 idempotent = idempotent,
                                  headers = {
                                             'Content-Type':content_type,
                                             'Authorization':f"Bearer {self._token}"
@@ -362,32 +2104,243 @@ class eln():
                                  json = kwargs
                                  )
         else:
-            return requests.post(
+            return self.transport.post(
                                  url = url,
+                                 idempotent = idempotent,
                                  headers = {
                                             'Content-Type':content_type,
                                             'Authorization':f"Bearer {self._token}"
                                            }
                                  )
 
+    def stream_url(self,
+                   url:str,
+                   **kwargs):
+        return self.transport.post(
+                                   url = url,
+                                   idempotent = True,
+                                   headers = {
+                                              'Content-Type':self._headers_json,
+                                              'Authorization':f"Bearer {self._token}"
+                                             },
+                                   json = kwargs,
+                                   stream = True
+                                   )
+
+    def chunk_ranges(self,
+                     items:list,
+                     chunk_rows:Union[int,None] = None,
+                     chunk_bytes:Union[int,None] = None) -> List[tuple]:
+        """
+        按行数和/或JSON字节数切分items，返回[(start,stop),...]；单行超过chunk_bytes时独占一块
+        """
+        if chunk_rows is None and chunk_bytes is None:
+            return [(0,len(items))] if len(items) > 0 else []
+        ranges = []
+        start,size = 0,0
+        for i,item in enumerate(items):
+            item_size = len(json.dumps(item,default=eln_json_default)) if chunk_bytes is not None else 0
+            if i > start and (
+                              (chunk_rows is not None and i - start >= chunk_rows) or
+                              (chunk_bytes is not None and size + item_size > chunk_bytes)
+                              ):
+                ranges.append((start,i))
+                start,size = i,0
+            size += item_size
+        if start < len(items):
+            ranges.append((start,len(items)))
+        return ranges
+
+    def submit_chunks(self,
+                      url:str,
+                      payload_func,
+                      ranges:List[tuple],
+                      max_workers:int = 1,
+                      error:str = "导入失败！") -> List[dict]:
+        """
+        用有限线程池并行提交payload_func(start,stop)生成的各块数据，按顺序返回每块状态；全部失败时抛出IOError
+        """
+        if self.spool is not None:
+            return [self.spool_chunk(url,payload_func,i,start,stop) for i,(start,stop) in enumerate(ranges)]
+        def send(chunk):
+            i,(start,stop) = chunk
+            return self.send_chunk(url,payload_func,i,start,stop)
+        max_workers = self.workers(max_workers)
+        if max_workers <= 1 or len(ranges) <= 1:
+            out = [send(chunk) for chunk in enumerate(ranges)]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                out = list(pool.map(send,enumerate(ranges)))
+        if len(out) > 0 and all(status["status"] != "OK" for status in out):
+            raise IOError(error)
+        return out
+
+    def workers(self,max_workers:int) -> int:
+        ### 启用自适应限流时由限流器控制实际并发数，线程数不超过限流上限
+        limiter = self.transport.limiter
+        return max_workers if limiter is None else min(max_workers,limiter.max_limit)
+
+    def limits(self) -> Union[dict,None]:
+        """当前并发上限、每秒请求数、平均延迟与过载次数；未启用限流时返回None"""
+        return None if self.transport.limiter is None else self.transport.limiter.status()
+
+    def spool_chunk(self,
+                    url:str,
+                    payload_func,
+                    i:int,
+                    start:int,
+                    stop:int) -> dict:
+        with self.timed("build",stage="payload"):
+            payload = payload_func(start,stop)
+        return {"chunk":i,"rows":(start,stop),"status":"spooled","error":None,
+                "id":self.spool.append(eln_endpoint(url),payload)}
+
+    def check_upload(self,eln_name:str):
+        ### 写入上传日志时不访问服务器，若尚未获取记录本列表则在回放时由服务器校验
+        if self.spool is not None and not hasattr(self,'eln'):
+            return
+        self.refresh_AccessToken()
+        if not hasattr(self,'eln'):
+            self.eln_list()
+        self.check_eln([eln_name])
+
+    def drain_spool(self,
+                    batch_size:int = 50,
+                    max_workers:int = 1) -> int:
+        """
+        回放一批到期的上传日志，返回成功上传的条数
+        """
+        jobs = self.spool.claim(batch_size)
+        if len(jobs) == 0:
+            return 0
+        urls = {"import":self._import_url,"update":self._update_url}
+        def send(job):
+            job_id,endpoint,payload = job
+            try:
+                self.refresh_AccessToken()
+            except (requests.RequestException,ValueError,KeyError) as e:
+                self.spool.retry(job_id,repr(e))
+                return False
+            status = self.send_chunk(urls[endpoint],lambda start,stop: payload,job_id,0,1)
+            if status["status"] == "OK":
+                sync = self.spool.done(job_id)
+                if sync is not None and self.sync_index is not None:
+                    self.sync_index.record_hashes(sync["eln"],sync["uid"],sync["modules"])
+                return True
+            self.spool.retry(job_id,status["error"])
+            return False
+        max_workers = self.workers(max_workers)
+        if max_workers <= 1:
+            return sum(send(job) for job in jobs)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return sum(pool.map(send,jobs))
+
+    def flush_spool(self,
+                    timeout:Union[float,None] = None,
+                    batch_size:int = 50,
+                    max_workers:int = 1) -> Dict[str,int]:
+        """
+        前台回放上传日志直到没有待上传数据（失败次数达到上限的除外）或超时，返回各状态条数
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.spool.counts().get("pending",0) + self.spool.counts().get("sending",0) > 0:
+            if deadline is not None and time.time() >= deadline:
+                break
+            if self.drain_spool(batch_size,max_workers) == 0:
+                ### 其他回放方持有的数据要等其租约到期
+                wait = self.spool.next_at() - time.time()
+                if deadline is not None:
+                    wait = min(wait,deadline - time.time())
+                time.sleep(min(1.,max(0.,wait)))
+        return self.spool.counts()
+
+    def start_spool(self,
+                    batch_size:int = 50,
+                    max_workers:int = 1,
+                    interval:float = 1.):
+        """启动后台线程持续回放上传日志"""
+        if self.spool is None:
+            raise ValueError("start_spool需要设置spool！")
+        if self._spool_thread is not None and self._spool_thread.is_alive():
+            return
+        self._spool_stop.clear()
+        def run():
+            while not self._spool_stop.is_set():
+                if self.drain_spool(batch_size,max_workers) == 0:
+                    self._spool_stop.wait(interval)
+        self._spool_thread = threading.Thread(target=run,daemon=True)
+        self._spool_thread.start()
+
+    def stop_spool(self,timeout:Union[float,None] = None):
+        if self._spool_thread is not None:
+            self._spool_stop.set()
+            self._spool_thread.join(timeout)
+            self._spool_thread = None
+
+    def send_chunk(self,
+                   url:str,
+                   payload_func,
+                   i:int,
+                   start:int,
+                   stop:int) -> dict:
+        status = {"chunk":i,"rows":(start,stop),"status":"OK","error":None}
+        try:
+            with self.timed("build",stage="payload"):
+                payload = payload_func(start,stop)
+            for _ in range(2):
+                response = self.request_url(url = url,
+                                            content_type = self._headers_json,
+                                            **payload)
+                errcode = self.response_errcode(response)
+                if errcode != "refresh":
+                    break
+                self.get_AccessToken()
+            if response.status_code != 200:
+                status["status"],status["error"] = "error",f"HTTP {response.status_code}"
+            elif errcode not in (0,None):
+                status["status"],status["error"] = "error",f"errcode {errcode}"
+        except (requests.RequestException,ValueError,TypeError) as e:
+            status["status"],status["error"] = "error",repr(e)
+        return status
+
+    def response_errcode(self,response):
+        ### 响应体不是含errcode的JSON时返回None
+        try:
+            out = eln_response_json(response)
+        except ValueError:
+            return None
+        return out.get("errcode") if isinstance(out,dict) else None
+
     #@property
     def eln_list(self):
         self.eln = []
-        errcode = "refresh"        
-        while errcode == "refresh":
+        errcode = "refresh"
+        for _ in range(self.transport.max_retries + 1):
             self.refresh_AccessToken()
             response = self.request_url(
                                         url=self._elns_url,
                                         content_type=self._headers_url
                                         )
             errcode = self.respose_status(response)
+            if errcode != "refresh":
+                break
+        if errcode == "refresh":
+            raise SystemExit("认证Token信息无效!")
         if errcode == 'OK':
-            self.eln = [response.json()['my'][i]['showtext'] for i in range(len(response.json()['my']))]
+            self.eln = self.eln_names(eln_response_json(response))
             #return [response.json()['my'][i]['showtext'] for i in range(len(response.json()['my']))]
         #else:
             #self.eln = []
             #return None
 
+    def eln_names(self,response_json:dict) -> List[str]:
+        return [response_json['my'][i]['showtext'] for i in range(len(response_json['my']))]
+
+    def check_eln(self,eln_name_list:List[str]):
+        for eln_name in eln_name_list:
+            if eln_name not in self.eln:
+                raise KeyError("没有该记录本！")
+
     def add_module(self,
                    module_type:str,
                    module_name:str = None,
@@ -479,6 +2432,12 @@ class eln():
         out["quote"] = quote if quote is not None else None
         return out 
     
+    def slice_import_args(self,start:int,stop:int,**kwargs) -> dict:
+        for key in ["dataset_in","title_list","uid_list","keyword_list"]:
+            if kwargs.get(key) is not None:
+                kwargs[key] = kwargs[key][start:stop]
+        return kwargs
+
     def import_data(self,
                     eln_name:str,
                     template_name:str,
@@ -487,30 +2446,28 @@ class eln():
                     uid_list:Union[List[dict],None]=None,
                     keyword_list:Union[List[dict],None]=None,
                     quote:Union[List[dict],None]=None,
-                    ):
-        self.refresh_AccessToken()
-        if not hasattr(self,'eln'):
-            self.eln_list()
-        if eln_name not in self.eln:
-            raise KeyError("没有该记录本！")
-        elif len(dataset_in) == 0:
+                    chunk_rows:Union[int,None]=None,
+                    chunk_bytes:Union[int,None]=None,
+                    max_workers:int=1,
+                    ) -> List[dict]:
+        self.check_upload(eln_name)
+        if len(dataset_in) == 0:
             raise ValueError("没有导入数据")
         else:
-            response = self.request_url(
-                                        url = self._import_url,
-                                        content_type = self._headers_json,
-                                        **self.import_json_data(
-                                                                eln_name=eln_name,
-                                                                title_list=title_list,
-                                                                uid_list=uid_list,
-                                                                keyword_list=keyword_list,
-                                                                quote = quote,
-                                                                template_name=template_name,
-                                                                dataset_in = dataset_in
-                                                                )
-                                        )
-            if response.status_code != 200:
-                raise IOError("导入失败！")
+            def payload(start,stop):
+                return self.import_json_data(**self.slice_import_args(start,stop,
+                                                                      eln_name=eln_name,
+                                                                      title_list=title_list,
+                                                                      uid_list=uid_list,
+                                                                      keyword_list=keyword_list,
+                                                                      quote = quote,
+                                                                      template_name=template_name,
+                                                                      dataset_in = dataset_in))
+            return self.submit_chunks(url = self._import_url,
+                                      payload_func = payload,
+                                      ranges = self.chunk_ranges(dataset_in,chunk_rows,chunk_bytes),
+                                      max_workers = max_workers,
+                                      error = "导入失败！")
 
     def export_json_data(self,
                          eln_name_list:List[str],
@@ -536,16 +2493,16 @@ class eln():
                     date_start:str = None,
                     date_end:str = None,
                     keywords:list = None,
-                    uids:list = None) -> dict:
+                    uids:list = None,
+                    executor:Union[Executor,None] = None,
+                    batch_size:int = 64) -> dict:
         self.refresh_AccessToken()
         if not hasattr(self,'eln'):
             self.eln_list()
         if type(eln_name_list) == str:
             eln_name_list = [eln_name_list]
-        for eln_name in eln_name_list:
-            if eln_name not in self.eln:
-                raise KeyError("没有该记录本！")
-        else:
+        self.check_eln(eln_name_list)
+        for _ in range(2):
             response = self.request_url(
                                         url = self._export_url,
                                         content_type = self._headers_json,
@@ -555,11 +2512,20 @@ class eln():
                                                                 keywords=keywords,
                                                                 uids=uids)
                                         )
-            if response.status_code != 200:
-                raise IOError("导出数据失败！")
-            else:
-                datasets = response.json()["dataset"]
-                """
+            if self.response_errcode(response) != "refresh":
+                break
+            self.get_AccessToken()
+        if response.status_code != 200 or self.response_errcode(response) == "refresh":
+            raise IOError("导出数据失败！")
+        else:
+            return self.export_out(eln_response_json(response)["dataset"],data_func,executor=executor,batch_size=batch_size)
+
+    def export_out(self,
+                   datasets:List[dict],
+                   data_func,
+                   executor:Union[Executor,None] = None,
+                   batch_size:int = 64) -> dict:
+        """
                 datasets:List[dict]
                 datasets[i]:dict=dataset
                                  dataset:{
@@ -584,12 +2550,313 @@ class eln():
                                                                            "name":name,
                                                                            "type":type
                                                                           }
-                """
-                out = {}
-                for dataset in datasets:
-                    out[dataset["title"]] = [data_func(pd.DataFrame(dataset["data"][i]["data"]).set_index("name")[["data","type"]]) 
-                                             for i in range(len(dataset["data"]))]
-                return out
+        """
+        out = {}
+        for dataset,results in self.map_datasets(datasets,data_func,executor=executor,batch_size=batch_size):
+            out[dataset["title"]] = results
+        return out
+
+    def export_dataset(self,
+                       dataset:dict,
+                       data_func) -> list:
+        return [data_func(eln_module_frame(dataset["data"][i])) 
+                for i in range(len(dataset["data"]))]
+
+    def map_datasets(self,
+                     datasets,
+                     data_func,
+                     executor:Union[Executor,None] = None,
+                     batch_size:int = 64,
+                     prefetch:Union[int,None] = None):
+        """
+        逐条产出(dataset,data_func结果列表)，顺序与输入一致。
+        指定executor（如ProcessPoolExecutor）时，跨记录把原始模块字典按batch_size分批提交，
+        同时最多prefetch批在执行；使用进程池时data_func须为可pickle的模块级函数
+        """
+        if executor is None:
+            for dataset in datasets:
+                yield dataset,self.export_dataset(dataset,data_func)
+            return
+        prefetch = 2 * (getattr(executor,"_max_workers",None) or os.cpu_count() or 1) if prefetch is None else prefetch
+        slots = collections.deque()   ### [dataset,结果,未完成模块数]
+        futures = collections.deque() ### (future,各模块所属slot)
+        batch,owners = [],[]
+        def submit():
+            futures.append((executor.submit(eln_apply_batch,data_func,list(batch)),list(owners)))
+            batch.clear()
+            owners.clear()
+        def resolve():
+            future,slot_list = futures.popleft()
+            for slot,result in zip(slot_list,future.result()):
+                slot[1].append(result)
+                slot[2] -= 1
+        for dataset in datasets:
+            slot = [dataset,[],len(dataset["data"])]
+            slots.append(slot)
+            for module in dataset["data"]:
+                batch.append(module)
+                owners.append(slot)
+                if len(batch) >= batch_size:
+                    submit()
+            while len(futures) > prefetch or (len(futures) > 0 and futures[0][0].done()):
+                resolve()
+            while len(slots) > 0 and slots[0][2] == 0:
+                done = slots.popleft()
+                yield done[0],done[1]
+        if len(batch) > 0:
+            submit()
+        while len(futures) > 0:
+            resolve()
+        while len(slots) > 0:
+            done = slots.popleft()
+            yield done[0],done[1]
+
+    def date_windows(self,
+                     date_start:str,
+                     date_end:str,
+                     window_days:float) -> List[tuple]:
+        """
+        将[date_start,date_end]按window_days天切分为若干时间窗，格式与输入一致
+        """
+        if date_start is None or date_end is None:
+            raise ValueError("按时间窗导出需要同时指定date_start和date_end！")
+        start = datetime.datetime.fromisoformat(date_start)
+        end = datetime.datetime.fromisoformat(date_end)
+        fmt = "%Y-%m-%d" if len(date_start) <= 10 and len(date_end) <= 10 else "%Y-%m-%d %H:%M:%S"
+        step = datetime.timedelta(days=window_days)
+        out = []
+        while start < end:
+            stop = min(start + step,end)
+            out.append((start.strftime(fmt),stop.strftime(fmt)))
+            start = stop
+        return out
+
+    def iter_export(self,
+                    eln_name_list:Union[List[str],str],
+                    data_func = None,
+                    date_start:str = None,
+                    date_end:str = None,
+                    keywords:list = None,
+                    uids:list = None,
+                    window_days:Union[float,None] = None,
+                    chunk_size:int = 1 << 20,
+                    executor:Union[Executor,None] = None,
+                    batch_size:int = 64):
+        """
+        流式导出：边下载边解析，逐条产出(title,modules)；data_func为None时modules为原始模块字典列表。
+        指定window_days时按时间窗分多次请求，相邻时间窗边界上的重复记录按id去除；
+        指定executor时data_func在其中分批执行，见map_datasets
+        """
+        datasets = self.iter_datasets(eln_name_list=eln_name_list,
+                                      date_start=date_start,
+                                      date_end=date_end,
+                                      keywords=keywords,
+                                      uids=uids,
+                                      window_days=window_days,
+                                      chunk_size=chunk_size)
+        if data_func is None:
+            for dataset in datasets:
+                yield dataset["title"],dataset["data"]
+        else:
+            for dataset,results in self.map_datasets(datasets,data_func,executor=executor,batch_size=batch_size):
+                yield dataset["title"],results
+
+    def iter_datasets(self,
+                      eln_name_list:Union[List[str],str],
+                      date_start:str = None,
+                      date_end:str = None,
+                      keywords:list = None,
+                      uids:list = None,
+                      window_days:Union[float,None] = None,
+                      chunk_size:int = 1 << 20):
+        """流式导出，逐条产出服务器返回的原始记录字典"""
+        self.refresh_AccessToken()
+        if not hasattr(self,'eln'):
+            self.eln_list()
+        if type(eln_name_list) == str:
+            eln_name_list = [eln_name_list]
+        self.check_eln(eln_name_list)
+        windows = [(date_start,date_end)] if window_days is None else self.date_windows(date_start,date_end,window_days)
+        last_ids = set()
+        for window_start,window_end in windows:
+            ids = set()
+            self.refresh_AccessToken()
+            for attempt in range(2):
+                response = self.stream_url(url = self._export_url,
+                                           **self.export_json_data(eln_name_list=eln_name_list,
+                                                                   date_start=window_start,
+                                                                   date_end=window_end,
+                                                                   keywords=keywords,
+                                                                   uids=uids))
+                with response:
+                    if response.status_code != 200:
+                        raise IOError("导出数据失败！")
+                    stream = eln_json_stream(response.iter_content(chunk_size=chunk_size),key="dataset")
+                    received = 0
+                    for dataset in stream:
+                        received += 1
+                        dataset_id = dataset.get("id")
+                        if dataset_id is not None:
+                            ids.add(dataset_id)
+                            if dataset_id in last_ids:
+                                continue
+                        yield dataset
+                    errcode = stream.fields.get("errcode",0)
+                ### Token失效时服务器不返回数据，重新登录后重试该窗口
+                if errcode == "refresh" and attempt == 0 and received == 0:
+                    self.get_AccessToken()
+                    continue
+                if errcode != 0:
+                    raise IOError("导出数据失败！")
+                break
+            last_ids = ids
+
+    def export_cached(self,
+                      eln_name_list:Union[List[str],str],
+                      data_func = None,
+                      keywords:list = None,
+                      uids:list = None,
+                      refresh:bool = False,
+                      executor:Union[Executor,None] = None) -> Union[dict,List[dict]]:
+        """
+        经export_cache导出：缓存未过期时不访问服务器，过期后只导出上次导出之后的新记录，refresh为True时全部重新导出。
+        data_func为None时返回原始记录列表，否则与export_data返回值相同
+        """
+        if self.export_cache is None:
+            raise ValueError("export_cached需要设置export_cache！")
+        if type(eln_name_list) == str:
+            eln_name_list = [eln_name_list]
+        cache = self.export_cache
+        key = cache.key(eln_name_list,keywords,uids)
+        entry = None if refresh else cache.entry(key)
+        if entry is None or time.time() - entry[1] >= cache.ttl:
+            high_water = (datetime.datetime.now() - datetime.timedelta(seconds=cache.overlap)).strftime("%Y-%m-%d %H:%M:%S")
+            cache.merge(key,
+                        self.iter_datasets(eln_name_list=eln_name_list,
+                                           date_start=None if entry is None else entry[0],
+                                           keywords=keywords,
+                                           uids=uids),
+                        high_water=high_water,
+                        replace=entry is None)
+        datasets = cache.datasets(key)
+        return datasets if data_func is None else self.export_out(datasets,data_func,executor=executor)
+
+    def export_parallel(self,
+                        eln_name_list:Union[List[str],str],
+                        data_func = None,
+                        date_start:str = None,
+                        date_end:str = None,
+                        keywords:list = None,
+                        uids:list = None,
+                        window_days:Union[float,None] = None,
+                        max_workers:int = 4,
+                        max_attempts:int = 3,
+                        executor:Union[Executor,None] = None) -> Union[dict,List[dict]]:
+        """
+        按记录本和时间窗拆分为多个导出请求并发执行，失败的子请求单独重试，结果按记录本、时间窗顺序合并。
+        data_func为None时返回原始记录列表，否则与export_data返回值相同
+        """
+        self.refresh_AccessToken()
+        if not hasattr(self,'eln'):
+            self.eln_list()
+        if type(eln_name_list) == str:
+            eln_name_list = [eln_name_list]
+        self.check_eln(eln_name_list)
+        windows = [(date_start,date_end)] if window_days is None else self.date_windows(date_start,date_end,window_days)
+        tasks = [(eln_name,window) for eln_name in eln_name_list for window in windows]
+        def fetch(task):
+            eln_name,(window_start,window_end) = task
+            for attempt in range(max_attempts):
+                try:
+                    return list(self.iter_datasets(eln_name_list=[eln_name],
+                                                   date_start=window_start,
+                                                   date_end=window_end,
+                                                   keywords=keywords,
+                                                   uids=uids))
+                except (requests.RequestException,IOError,ValueError) as e:
+                    if attempt + 1 >= max_attempts:
+                        return e
+                    time.sleep(self.transport.backoff(attempt))
+        with ThreadPoolExecutor(max_workers=max(1,self.workers(max_workers))) as pool:
+            results = list(pool.map(fetch,tasks))
+        failed = [(task,result) for task,result in zip(tasks,results) if isinstance(result,Exception)]
+        if len(failed) > 0:
+            raise IOError("导出数据失败！" + "；".join(f"{eln_name} {window}: {error!r}" for (eln_name,window),error in failed))
+        datasets,seen = [],set()
+        for (eln_name,_),result in zip(tasks,results):
+            for dataset in result:
+                ### 相邻时间窗边界上的记录可能重复
+                key = (eln_name,dataset.get("id"))
+                if dataset.get("id") is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                datasets.append(dataset)
+        return datasets if data_func is None else self.export_out(datasets,data_func,executor=executor)
+
+    export_columns = ["eln","dataset_id","title","uid","module_uid","module_name","name","type","data"]
+
+    def flatten_datasets(self,
+                         datasets) -> Dict[str,list]:
+        """
+        将记录、模块、数据项逐层展开为长表的各列，一次遍历完成
+        """
+        columns = {key:[] for key in self.export_columns}
+        eln_col,id_col,title_col,uid_col,module_uid_col,module_name_col,name_col,type_col,data_col = columns.values()
+        for dataset,module,entries in eln_iter_modules(datasets):
+            n = len(entries)
+            for column,value in zip((eln_col,id_col,title_col,uid_col),(dataset.get("eln_name"),dataset.get("id"),dataset.get("title"),dataset.get("uid"))):
+                column.extend([value] * n)
+            module_uid_col.extend([module.get("uid")] * n)
+            module_name_col.extend([module.get("name")] * n)
+            for entry in entries:
+                name_col.append(entry.get("name"))
+                type_col.append(entry.get("type"))
+                data_col.append(entry.get("data"))
+        return columns
+
+    def export_frame(self,
+                     eln_name_list:Union[List[str],str],
+                     date_start:str = None,
+                     date_end:str = None,
+                     keywords:list = None,
+                     uids:list = None,
+                     window_days:Union[float,None] = None) -> pd.DataFrame:
+        """
+        导出为一张长表，每行一个数据项，列为export_columns，可直接用pandas向量化筛选、分组
+        """
+        return pd.DataFrame(self.flatten_datasets(self.iter_datasets(eln_name_list=eln_name_list,
+                                                                     date_start=date_start,
+                                                                     date_end=date_end,
+                                                                     keywords=keywords,
+                                                                     uids=uids,
+                                                                     window_days=window_days)),
+                            columns=self.export_columns)
+
+    def export_to(self,
+                  path:str,
+                  eln_name_list:Union[List[str],str],
+                  date_start:str = None,
+                  date_end:str = None,
+                  keywords:list = None,
+                  uids:list = None,
+                  window_days:Union[float,None] = None,
+                  format:str = "parquet",
+                  batch_rows:int = 65536,
+                  mode:str = "overwrite") -> eln_export_sink:
+        """
+        流式导出并写入列式文件（见eln_export_sink），用eln_read_export按列读回；返回已关闭的sink，含行数与文件列表。
+        mode默认“overwrite”，重复导出到同一目录时替换涉及的记录本分区；增量导出到已有目录时用“append”
+        """
+        with eln_export_sink(path,format=format,batch_rows=batch_rows,mode=mode) as sink:
+            for dataset in self.iter_datasets(eln_name_list=eln_name_list,
+                                              date_start=date_start,
+                                              date_end=date_end,
+                                              keywords=keywords,
+                                              uids=uids,
+                                              window_days=window_days):
+                sink.write([dataset])
+        return sink
 
     def update_json_data(self,
                          eln_name:str,
@@ -628,35 +2895,85 @@ class eln():
                                                                         data=data_in[i]["data"]).out)
         return module_out,data_out
 
+    def update_rows(self,
+                    module_name:List[str],
+                    module_type:List[str],
+                    data_func,
+                    data_in:pd.DataFrame) -> List[tuple]:
+        if max(len(module_name),len(module_type),len(data_in)) != min(len(module_name),len(module_type),len(data_in)):
+            raise TypeError("数据集长度不一样！")
+        with self.timed("build",stage="update_rows"):
+            if isinstance(data_func,eln_template):
+                for name in set(module_type):
+                    if name not in self.module_dict.keys():
+                        raise TypeError("只能导入“表单”、“表格”、“图片”、“富文本”和“图表”模块！")
+                return data_func.rows(module_name=module_name,
+                                      module_type=module_type,
+                                      data_in=data_in)
+            return [self.update_template(module_name=module_name[i],
+                                         module_type=module_type[i],
+                                         data_func=data_func,
+                                         data_in=data_in.loc[index])
+                    for i,index in enumerate(data_in.index)]
+
+    def update_chunk_json(self,
+                          eln_name:str,
+                          uid:str,
+                          rows:List[tuple],
+                          start:int,
+                          stop:int) -> dict:
+        ### 每行的模块与其数据放在同一块中提交
+        module_out, data_out = [],[]
+        for add_module, add_data in rows[start:stop]:
+            module_out += add_module
+            data_out += add_data
+        return self.update_json_data(
+                                     eln_name=eln_name,
+                                     uid=uid,
+                                     addModule = module_out,
+                                     add = data_out
+                                     )
+
     def update_data(self,
                     eln_name:str,
                     uid:str,
                     module_name:str,
                     module_type:str,
                     data_func,
-                    data_in:Union[pd.Series,None]=None):
-        self.refresh_AccessToken()
-        if not hasattr(self,'eln'):
-            self.eln_list()
-        if eln_name not in self.eln:
-            raise KeyError("没有该记录本！")
-        else:
-            add_module, add_data = self.update_template(module_name=module_name,
-                                                        module_type=module_type,
-                                                        data_func=data_func,
-                                                        data_in=data_in)
-            response = self.request_url(
-                                        url = self._update_url,
-                                        content_type = self._headers_json,
-                                        **self.update_json_data(
-                                                                eln_name=eln_name,
-                                                                uid=uid,
-                                                                addModule = add_module,
-                                                                add = add_data
-                                                                )
+                    data_in:Union[pd.Series,None]=None) -> List[dict]:
+        self.check_upload(eln_name)
+        add_module, add_data = self.update_template(module_name=module_name,
+                                                    module_type=module_type,
+                                                    data_func=data_func,
+                                                    data_in=data_in)
+        payload = self.update_json_data(
+                                        eln_name=eln_name,
+                                        uid=uid,
+                                        addModule = add_module,
+                                        add = add_data
                                         )
-            if response.status_code != 200:
-                raise IOError("导入失败！")
+        if self.coalescer is not None:
+            return self.coalescer.add(eln_name,uid,add_module,add_data)
+        return self.submit_chunks(url = self._update_url,
+                                  payload_func = lambda start,stop: payload,
+                                  ranges = [(0,1)],
+                                  error = "导入失败！")
+
+    @contextlib.contextmanager
+    def coalesce(self,
+                 max_modules:int = 100,
+                 max_bytes:Union[int,None] = None,
+                 max_delay:float = 1.):
+        """
+        在with块内update_data不再逐次请求，而是由eln_coalescer合并发送并返回Future；退出时发送剩余数据
+        """
+        coalescer = eln_coalescer(self,max_modules=max_modules,max_bytes=max_bytes,max_delay=max_delay)
+        self.coalescer = coalescer
+        try:
+            yield coalescer
+        finally:
+            self.coalescer = None
+            coalescer.close()
 
     def update_dataset(self,
                        eln_name:str,
@@ -664,34 +2981,825 @@ class eln():
                        module_name:List[str],
                        module_type:List[str],
                        data_func,
-                       data_in:Union[pd.DataFrame,None]=None):
+                       data_in:Union[pd.DataFrame,None]=None,
+                       chunk_rows:Union[int,None]=None,
+                       chunk_bytes:Union[int,None]=None,
+                       max_workers:int=1,
+                       only_changed:bool=False) -> List[dict]:
+        """
+        only_changed为True时借助sync_index只上传新增或内容有变化的模块，返回的各块行号对应实际上传的模块
+        """
+        self.check_upload(eln_name)
+        rows = self.update_rows(module_name=module_name,
+                                module_type=module_type,
+                                data_func=data_func,
+                                data_in=data_in)
+        rows,hashes = self.sync_filter(eln_name,uid,rows,only_changed)
+        status = self.submit_chunks(url = self._update_url,
+                                    payload_func = lambda start,stop: self.update_chunk_json(eln_name,uid,rows,start,stop),
+                                    ranges = self.chunk_ranges(rows,chunk_rows,chunk_bytes),
+                                    max_workers = max_workers,
+                                    error = "导入失败！")
+        self.sync_record(eln_name,uid,rows,hashes,status)
+        return status
+
+    def reconcile(self,
+                  eln_name:str,
+                  uid:str,
+                  module_name:List[str],
+                  module_type:List[str],
+                  data_func,
+                  data_in:pd.DataFrame,
+                  dry_run:bool = False,
+                  chunk_rows:Union[int,None] = None,
+                  chunk_bytes:Union[int,None] = None,
+                  max_workers:int = 1,
+                  template_modules:Union[List[str],None] = None,
+                  send_changed:bool = True,
+                  verify:bool = False) -> dict:
+        """
+        与服务器上(eln,uid)记录的现有模块比对后只发送差异：以模块名和数据名为键，
+        服务器没有的模块连同数据一起新建，已有模块只发送新增或值/类型有变化的数据项。
+        服务器上有而data_in中没有的模块只报告为stale_modules，不删除；导入模板生成的模块
+        （template_modules，默认为记录的第一个模块）不在其中。
+        dry_run为True时只返回将要发生的变化与请求体字节数payload_bytes，不上传；上传时payload_bytes为None。
+
+        平台的update接口只追加：addModule总是新建模块，add总是追加数据项，没有覆盖或删除。
+        因此已有模块不会再次addModule；值有变化的数据项追加为同名新项，导出时同名项以最后一项为准
+        （send_changed为False时只报告不发送）。verify为True时上传后再导出一次该记录，
+        检查发送的模块没有重复、每个数据项按最后一项读回的值与发送的一致，结果写入report["verified"]
+        """
+        self.check_upload(eln_name)
+        rows = self.update_rows(module_name=module_name,
+                                module_type=module_type,
+                                data_func=data_func,
+                                data_in=data_in)
+        current,counts,first = self.record_modules(eln_name,uid)
+        if template_modules is None:
+            template_modules = [] if first is None else [first]
+        report = {"modules_added":[],"entries_added":[],"entries_changed":[],"unchanged":0,
+                  "stale_modules":sorted(set(current) - set(module_name) - set(template_modules),key=str),
+                  "payload_bytes":None,"status":[]}
+        delta,targets = [],[] ### 差异行及其在rows中的位置
+        for i,(add_module,add_data) in enumerate(rows):
+            name = add_module[0]["name"]
+            if name not in current:
+                report["modules_added"].append(name)
+                report["entries_added"] += [(name,entry["name"]) for entry in add_data]
+                delta.append((add_module,add_data))
+                targets.append(i)
+                continue
+            changed = []
+            for entry in add_data:
+                old = current[name].get(entry["name"])
+                if old is None:
+                    report["entries_added"].append((name,entry["name"]))
+                elif old.get("type") != entry["type"] or not eln_same_value(old.get("data"),entry["data"]):
+                    report["entries_changed"].append((name,entry["name"]))
+                    if not send_changed:
+                        continue
+                else:
+                    report["unchanged"] += 1
+                    continue
+                changed.append(entry)
+            if len(changed) > 0:
+                delta.append(([],changed))
+                targets.append(i)
+        ranges = self.chunk_ranges(delta,chunk_rows,chunk_bytes)
+        if dry_run:
+            report["payload_bytes"] = sum(len(self.transport.dumps(self.update_chunk_json(eln_name,uid,delta,start,stop)))
+                                          for start,stop in ranges)
+            return report
+        if len(delta) == 0:
+            return report
+        report["status"] = self.submit_chunks(url = self._update_url,
+                                              payload_func = lambda start,stop: self.update_chunk_json(eln_name,uid,delta,start,stop),
+                                              ranges = ranges,
+                                              max_workers = max_workers,
+                                              error = "导入失败！")
+        if self.sync_index is not None:
+            ### 按完整模块记录哈希，与update_dataset的only_changed一致；无差异的模块已与服务器一致
+            pending = set(targets)
+            self.sync_index.record(eln_name,uid,[(row,self.sync_index.hash(row)) for i,row in enumerate(rows) if i not in pending])
+            full = [rows[i] for i in targets]
+            self.sync_record(eln_name,uid,full,[self.sync_index.hash(row) for row in full],report["status"])
+        if verify and self.spool is None:
+            report["verified"] = self.verify_delta(eln_name,uid,delta,report["status"],counts)
+        return report
+
+    def record_modules(self,eln_name:str,uid:str) -> tuple:
+        """
+        导出一条记录，返回({模块名:{数据名:数据项}},{模块名:同名模块数},第一个模块名)；
+        同名模块与同名数据项以最后一个为准
+        """
+        current,counts,first = {},{},None
+        found = False
+        for dataset in self.iter_datasets(eln_name_list=[eln_name],uids=[uid]):
+            if dataset.get("uid") != uid:
+                continue
+            found = True
+            for module in dataset.get("data") or []:
+                name = module.get("name")
+                first = name if first is None else first
+                counts[name] = counts.get(name,0) + 1
+                entries = module.get("data") if isinstance(module.get("data"),list) else []
+                current.setdefault(name,{}).update({entry.get("name"):entry for entry in entries})
+        if not found:
+            raise KeyError(f"记录本{eln_name}中没有uid为{uid}的记录！")
+        return current,counts,first
+
+    def verify_delta(self,
+                     eln_name:str,
+                     uid:str,
+                     delta:List[tuple],
+                     status:List[dict],
+                     counts:Dict[str,int]) -> dict:
+        """重新导出记录，检查上传成功的差异是否按追加语义生效"""
+        current,after,_ = self.record_modules(eln_name,uid)
+        out = {"ok":True,"duplicate_modules":[],"mismatched":[]}
+        for chunk in status:
+            if chunk["status"] != "OK":
+                continue
+            for add_module,add_data in delta[chunk["rows"][0]:chunk["rows"][1]]:
+                name = add_module[0]["name"] if len(add_module) > 0 else add_data[0]["module"]
+                if after.get(name,0) > counts.get(name,0) + len(add_module):
+                    out["duplicate_modules"].append(name)
+                for entry in add_data:
+                    got = current.get(name,{}).get(entry["name"])
+                    if got is None or not eln_same_value(got.get("data"),entry["data"]):
+                        out["mismatched"].append((name,entry["name"]))
+        out["ok"] = len(out["duplicate_modules"]) == 0 and len(out["mismatched"]) == 0
+        return out
+
+    def ingest_file(self,
+                    path:str,
+                    eln_name:str,
+                    uid:str,
+                    data_func,
+                    module_name = "{index}",
+                    module_type:str = "form",
+                    chunksize:int = 1000,
+                    max_workers:int = 4,
+                    queue_size:Union[int,None] = None,
+                    checkpoint:Union[str,None] = None,
+                    only_changed:bool = False,
+                    progress = None,
+                    **read_kwargs) -> List[dict]:
+        """
+        分块读取CSV或Parquet并上传到同一条记录：读取/生成数据与上传在不同线程中流水执行，
+        待上传的块数不超过queue_size，内存占用与文件大小无关。
+        module_name为含{index}的格式字符串或以行索引为参数的函数；
+        指定checkpoint文件时记录已确认的块，中断后重新运行会跳过这些块，文件、模板或参数改变时抛出ValueError；
+        progress(status)在每块完成（含跳过）后调用，可能来自上传线程，上传线程中的异常会停止读取并重新抛出
+        """
         self.refresh_AccessToken()
         if not hasattr(self,'eln'):
             self.eln_list()
-        if eln_name not in self.eln:
-            raise KeyError("没有该记录本！")
+        self.check_eln([eln_name])
+        if checkpoint is not None:
+            ### 文件或模板改变后块编号不再对应相同内容，断点作废
+            stat = os.stat(path)
+            checkpoint = eln_checkpoint(checkpoint,{"path":os.path.abspath(path),
+                                                    "size":stat.st_size,
+                                                    "mtime":stat.st_mtime_ns,
+                                                    "eln":eln_name,
+                                                    "uid":uid,
+                                                    "chunksize":chunksize,
+                                                    "template":eln_func_hash(data_func),
+                                                    "module_name":eln_func_hash(module_name),
+                                                    "module_type":module_type,
+                                                    "read_kwargs":json.dumps(read_kwargs,sort_keys=True,default=str)})
+        max_workers = self.workers(max_workers)
+        jobs = queue.Queue(maxsize=max(1,max_workers * 2 if queue_size is None else queue_size))
+        out = []
+        out_lock = threading.Lock()
+        errors = [] ### 上传线程中的异常，交给读取线程抛出
+        def upload():
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                if len(errors) > 0:
+                    continue
+                i,start,stop,rows,hashes = job
+                try:
+                    status = self.send_chunk(url = self._update_url,
+                                             payload_func = lambda start,stop: self.update_chunk_json(eln_name,uid,rows,start,stop),
+                                             i = i,
+                                             start = 0,
+                                             stop = len(rows))
+                    self.sync_record(eln_name,uid,rows,hashes,[status])
+                    status["rows"] = (start,stop)
+                    if checkpoint is not None and status["status"] == "OK":
+                        checkpoint.add(i)
+                    with out_lock:
+                        out.append(status)
+                    if progress is not None:
+                        progress(status)
+                except Exception as e:
+                    errors.append(e)
+        def put(job):
+            ### 队列满时阻塞读取，形成背压；上传线程出错时停止
+            while True:
+                if len(errors) > 0:
+                    raise errors[0]
+                try:
+                    jobs.put(job,timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        workers = [threading.Thread(target=upload,daemon=True) for _ in range(max(1,max_workers))]
+        for worker in workers:
+            worker.start()
+        try:
+            offset = 0
+            for i,frame in enumerate(eln_read_chunks(path,chunksize,**read_kwargs)):
+                start,offset = offset,offset + len(frame)
+                if checkpoint is not None and i in checkpoint:
+                    self.ingest_status(out,out_lock,progress,{"chunk":i,"rows":(start,offset),"status":"skipped","error":None})
+                    continue
+                names = [module_name(index) if callable(module_name) else module_name.format(index=index) for index in frame.index]
+                rows = self.update_rows(module_name=names,
+                                        module_type=[module_type] * len(frame),
+                                        data_func=data_func,
+                                        data_in=frame)
+                rows,hashes = self.sync_filter(eln_name,uid,rows,only_changed)
+                if len(rows) == 0:
+                    self.ingest_status(out,out_lock,progress,{"chunk":i,"rows":(start,offset),"status":"unchanged","error":None})
+                    if checkpoint is not None:
+                        checkpoint.add(i)
+                    continue
+                put((i,start,offset,rows,hashes))
+        finally:
+            for _ in workers:
+                while any(worker.is_alive() for worker in workers):
+                    try:
+                        jobs.put(None,timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+            for worker in workers:
+                worker.join()
+        if len(errors) > 0:
+            raise errors[0]
+        return sorted(out,key=lambda status: status["chunk"])
+
+    ingest_csv = ingest_file
+
+    def ingest_status(self,out:list,out_lock,progress,status:dict):
+        with out_lock:
+            out.append(status)
+        if progress is not None:
+            progress(status)
+
+    def upload_file(self,
+                    path:str,
+                    name:Union[str,None] = None) -> dict:
+        """
+        从磁盘流式上传文件（不整体读入内存），返回可直接加入图片集模块的{"name","url"}；
+        设置blob_registry时按内容哈希跳过已上传的文件，同一内容并发上传时只发送一次。
+        实验性接口：文件以application/octet-stream发送到upload_url（或环境变量eln_upload_url），
+        查询参数为name与sha256，文件地址取响应JSON的upload_field字段
+        """
+        name = os.path.basename(path) if name is None else name
+        registry = self.blob_registry
+        digest,size = eln_file_hash(path) if registry is None else registry.file_hash(path)
+        with self._blob_lock:
+            ref = None if registry is None else registry.get(self._base_url,digest)
+            if ref is not None:
+                return {"name":name,**ref}
+            future = self._blob_inflight.get(digest)
+            owner = future is None
+            if owner:
+                future = self._blob_inflight[digest] = Future()
+        if not owner:
+            return {"name":name,**future.result()}
+        try:
+            ref = self.send_file(path,name,digest,size)
+            if registry is not None:
+                registry.record(self._base_url,digest,size,ref)
+            future.set_result(ref)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._blob_lock:
+                self._blob_inflight.pop(digest,None)
+        return {"name":name,**ref}
+
+    def send_file(self,
+                  path:str,
+                  name:str,
+                  digest:str,
+                  size:int) -> dict:
+        if self._upload_url is None:
+            raise ValueError("文件上传为实验性接口，需要设置upload_url或环境变量eln_upload_url！")
+        self.refresh_AccessToken()
+        for _ in range(2):
+            with open(path,"rb") as f, self.timed("upload_file"):
+                response = self.transport.post(url = self._upload_url,
+                                               params = {"name":name,"sha256":digest},
+                                               headers = {
+                                                          'Content-Type':'application/octet-stream',
+                                                          'Content-Length':str(size),
+                                                          'Authorization':f"Bearer {self._token}"
+                                                         },
+                                               data = f)
+            errcode = self.response_errcode(response)
+            if errcode != "refresh":
+                break
+            self.get_AccessToken()
+        if response.status_code != 200 or errcode not in (0,None):
+            raise IOError(f"文件上传失败！{name}: HTTP {response.status_code}, errcode {errcode}")
+        return {"url":eln_response_json(response)[self._upload_field]}
+
+    def upload_files(self,
+                     paths:List[str],
+                     names:Union[List[str],None] = None,
+                     max_workers:int = 4) -> List[dict]:
+        """并行上传多个文件，按输入顺序返回引用"""
+        names = [None] * len(paths) if names is None else names
+        with ThreadPoolExecutor(max_workers=max(1,self.workers(max_workers))) as pool:
+            return list(pool.map(self.upload_file,paths,names))
+
+    def file_data(self,
+                  module_name:str,
+                  path:str,
+                  data_name:Union[str,None] = None) -> dict:
+        """上传文件并返回文件项（add数据）"""
+        ref = self.upload_file(path)
+        return self.add_data(module_name,"file",ref["url"],ref["name"] if data_name is None else data_name)
+
+    def sync_filter(self,
+                    eln_name:str,
+                    uid:str,
+                    rows:List[tuple],
+                    only_changed:bool) -> tuple:
+        if self.sync_index is None:
+            if only_changed:
+                raise ValueError("only_changed需要设置sync_index！")
+            return rows,None
+        if only_changed:
+            changed = self.sync_index.changed(eln_name,uid,rows)
+            if self.spool is not None and len(changed) > 0:
+                ### 已写入上传日志、尚未回放的相同内容不再重复写入
+                queued = self.spool.queued(eln_name,uid)
+                changed = [(row,row_hash) for row,row_hash in changed if queued.get(row[0][0]["name"]) != row_hash]
         else:
-            if max(len(module_name),len(module_type),len(data_in)) != min(len(module_name),len(module_type),len(data_in)):
-                raise TypeError("数据集长度不一样！")
+            changed = [(row,self.sync_index.hash(row)) for row in rows]
+        return [row for row,_ in changed],[row_hash for _,row_hash in changed]
+
+    def sync_record(self,
+                    eln_name:str,
+                    uid:str,
+                    rows:List[tuple],
+                    hashes:Union[List[str],None],
+                    status:List[dict]):
+        ### 只记录上传成功的块；写入上传日志的块附加到日志中，回放成功后再记录
+        if self.sync_index is None:
+            return
+        for chunk in status:
+            if chunk["status"] not in ("OK","spooled"):
+                continue
+            start,stop = chunk["rows"]
+            done = list(zip(rows[start:stop],hashes[start:stop]))
+            if chunk["status"] == "spooled":
+                sync = {"eln":eln_name,"uid":uid,"modules":[(row[0][0]["name"],row_hash) for row,row_hash in done]}
+                if self.spool.attach(chunk["id"],sync) != "done":
+                    continue
+            self.sync_index.record(eln_name,uid,done)
+
+class eln_async_response():
+    """异步请求结果，接口与requests.Response一致以复用respose_status"""
+    def __init__(self,
+                 status_code:int,
+                 content:bytes) -> None:
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+class async_eln():
+    """
+    物理所电子实验平台异步数据传输类：共享一个aiohttp连接池，以信号量限制并发请求数
+    登录、Token与请求体构造委托给内部的同步eln实例client，本类只提供协程接口
+    """
+    def __init__(self,
+                 max_concurrency:int = 10,
+                 pool_size:int = 10,
+                 timeout:Union[float,tuple,None] = None,
+                 max_retries:int = 3,
+                 backoff_factor:float = 0.5,
+                 token_store:Union[eln_token_store,bool,None] = True,
+                 sync_index:Union[eln_sync_index,None] = None,
+                 base_url:Union[str,None] = None,
+                 token_url:Union[str,None] = None,
+                 metrics:Union[eln_metrics,None] = None,
+                 limiter:Union[eln_limiter,bool,None] = None,
+                 json_backend:str = "json",
+                 client:Union[eln,None] = None):
+        if importlib.util.find_spec("aiohttp") is None:
+            raise ImportError("异步客户端需要安装aiohttp！")
+        ### 同步连接池仅用于登录获取Token
+        if client is None:
+            client = eln(pool_size=1,
+                         timeout=timeout,
+                         max_retries=max_retries,
+                         backoff_factor=backoff_factor,
+                         token_store=token_store,
+                         sync_index=sync_index,
+                         base_url=base_url,
+                         token_url=token_url,
+                         metrics=metrics,
+                         limiter=eln_limiter(max_limit=max_concurrency) if limiter is True else limiter,
+                         json_backend=json_backend)
+        self.client = client
+        self.transport = client.transport
+        self.metrics = client.metrics
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self._session = None
+        self._semaphore = None
+        self._eln_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*args):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.client.close()
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            timeout = self.transport.timeout
+            connect,read = timeout if isinstance(timeout,tuple) else (timeout,timeout)
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+                                                  timeout=aiohttp.ClientTimeout(sock_connect=connect,sock_read=read))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def limits(self) -> Union[dict,None]:
+        return self.client.limits()
+
+    async def refresh_AccessToken_async(self):
+        if not self.client.token_valid():
+            await asyncio.to_thread(self.client.refresh_AccessToken)
+
+    def unsent(self,error) -> bool:
+        ### 与eln_transport.unsent一致：只有连接阶段的错误可确认请求未发出
+        return isinstance(error,(aiohttp.ClientConnectorError,getattr(aiohttp,"ConnectionTimeoutError",aiohttp.ClientConnectorError)))
+
+    async def post(self,url:str,idempotent:bool = False,**kwargs) -> eln_async_response:
+        session = self.session
+        metrics = self.metrics
+        endpoint = eln_endpoint(url) if metrics is not None else None
+        if "json" in kwargs:
+            kwargs["data"] = self.transport.dumps(kwargs.pop("json"))
+        limiter = self.transport.limiter
+        for attempt in range(self.transport.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    if limiter is not None:
+                        await limiter.acquire_async()
+                    start = time.perf_counter()
+                    try:
+                        async with session.post(url,**kwargs) as response:
+                            out = eln_async_response(response.status,await response.read())
+                    except (aiohttp.ClientError,asyncio.TimeoutError):
+                        if limiter is not None:
+                            limiter.release(overload=True)
+                        raise
+                    except BaseException:
+                        if limiter is not None:
+                            limiter.release()
+                        raise
+                    if limiter is not None:
+                        limiter.release(time.perf_counter() - start,self.transport.need_retry(out))
+            except (aiohttp.ClientError,asyncio.TimeoutError) as e:
+                if metrics is not None:
+                    metrics.event("request",time.perf_counter() - start,endpoint=endpoint,status=type(e).__name__)
+                if attempt >= self.transport.max_retries or not (idempotent or self.unsent(e)):
+                    raise
             else:
-                module_out, data_out = [],[]
-                for i,index in enumerate(data_in.index):
-                    add_module, add_data = self.update_template(module_name=module_name[i],
-                                                                module_type=module_type[i],
-                                                                data_func=data_func,
-                                                                data_in=data_in.loc[index])
-                    module_out += add_module
-                    data_out += add_data
-                response = self.request_url(
-                                        url = self._update_url,
-                                        content_type = self._headers_json,
-                                        **self.update_json_data(
-                                                                eln_name=eln_name,
-                                                                uid=uid,
-                                                                addModule = module_out,
-                                                                add = data_out
-                                                                )
-                                        )
+                if metrics is not None:
+                    metrics.event("request",time.perf_counter() - start,
+                                  endpoint=endpoint,
+                                  status=str(out.status_code),
+                                  request_bytes=len(kwargs.get("data") or b""),
+                                  response_bytes=len(out.content))
+                if attempt >= self.transport.max_retries or not self.transport.need_retry(out):
+                    return out
+            if metrics is not None:
+                metrics.event("retry",endpoint=endpoint)
+            await asyncio.sleep(self.transport.backoff(attempt))
+
+    async def request_url(self,
+                          url:str,
+                          content_type:str,
+                          **kwargs) -> eln_async_response:
+        headers = {
+                   'Content-Type':content_type,
+                   'Authorization':f"Bearer {self.client._token}"
+                  }
+        idempotent = url not in (self.client._import_url,self.client._update_url)
+        if content_type == 'application/json':
+            return await self.post(url,idempotent=idempotent,headers=headers,json=kwargs)
+        else:
+            return await self.post(url,idempotent=idempotent,headers=headers)
+
+    async def submit_chunks(self,
+                            url:str,
+                            payload_func,
+                            ranges:List[tuple],
+                            error:str = "导入失败！") -> List[dict]:
+        async def send(i,start,stop):
+            status = {"chunk":i,"rows":(start,stop),"status":"OK","error":None}
+            try:
+                with self.client.timed("build",stage="payload"):
+                    payload = payload_func(start,stop)
+                for _ in range(2):
+                    response = await self.request_url(url = url,
+                                                      content_type = self.client._headers_json,
+                                                      **payload)
+                    errcode = self.client.response_errcode(response)
+                    if errcode != "refresh":
+                        break
+                    await asyncio.to_thread(self.client.get_AccessToken)
                 if response.status_code != 200:
-                    raise IOError("导入失败！")
+                    status["status"],status["error"] = "error",f"HTTP {response.status_code}"
+                elif errcode not in (0,None):
+                    status["status"],status["error"] = "error",f"errcode {errcode}"
+            except (aiohttp.ClientError,asyncio.TimeoutError,ValueError,TypeError) as e:
+                status["status"],status["error"] = "error",repr(e)
+            return status
+        out = await asyncio.gather(*[send(i,start,stop) for i,(start,stop) in enumerate(ranges)])
+        if len(out) > 0 and all(status["status"] != "OK" for status in out):
+            raise IOError(error)
+        return list(out)
+
+    async def eln_list(self):
+        errcode = "refresh"
+        for _ in range(self.transport.max_retries + 1):
+            await self.refresh_AccessToken_async()
+            response = await self.request_url(
+                                              url=self.client._elns_url,
+                                              content_type=self.client._headers_url
+                                              )
+            if eln_response_json(response)['errcode'] == "refresh":
+                await asyncio.to_thread(self.client.get_AccessToken)
+                continue
+            errcode = self.client.respose_status(response)
+            break
+        if errcode == "refresh":
+            raise SystemExit("认证Token信息无效!")
+        self.client.eln = self.client.eln_names(eln_response_json(response)) if errcode == 'OK' else []
+
+    async def prepare(self,eln_name_list:List[str]):
+        await self.refresh_AccessToken_async()
+        if not hasattr(self.client,'eln'):
+            if self._eln_lock is None:
+                self._eln_lock = asyncio.Lock()
+            async with self._eln_lock:
+                if not hasattr(self.client,'eln'):
+                    await self.eln_list()
+        self.client.check_eln(eln_name_list)
+
+    async def import_data(self,
+                          eln_name:str,
+                          template_name:str,
+                          dataset_in:List[dict],
+                          title_list:Union[List[dict],None]=None,
+                          uid_list:Union[List[dict],None]=None,
+                          keyword_list:Union[List[dict],None]=None,
+                          quote:Union[List[dict],None]=None,
+                          chunk_rows:Union[int,None]=None,
+                          chunk_bytes:Union[int,None]=None,
+                          ) -> List[dict]:
+        await self.prepare([eln_name])
+        if len(dataset_in) == 0:
+            raise ValueError("没有导入数据")
+        def payload(start,stop):
+            return self.client.import_json_data(**self.client.slice_import_args(start,stop,
+                                                                                eln_name=eln_name,
+                                                                                title_list=title_list,
+                                                                                uid_list=uid_list,
+                                                                                keyword_list=keyword_list,
+                                                                                quote = quote,
+                                                                                template_name=template_name,
+                                                                                dataset_in = dataset_in))
+        return await self.submit_chunks(url = self.client._import_url,
+                                        payload_func = payload,
+                                        ranges = self.client.chunk_ranges(dataset_in,chunk_rows,chunk_bytes),
+                                        error = "导入失败！")
+
+    async def export_data(self,
+                          eln_name_list:Union[List[str],str],
+                          data_func,
+                          date_start:str = None,
+                          date_end:str = None,
+                          keywords:list = None,
+                          uids:list = None) -> dict:
+        if type(eln_name_list) == str:
+            eln_name_list = [eln_name_list]
+        await self.prepare(eln_name_list)
+        for _ in range(2):
+            response = await self.request_url(
+                                              url = self.client._export_url,
+                                              content_type = self.client._headers_json,
+                                              **self.client.export_json_data(eln_name_list=eln_name_list,
+                                                                             date_start=date_start,
+                                                                             date_end=date_end,
+                                                                             keywords=keywords,
+                                                                             uids=uids)
+                                              )
+            if self.client.response_errcode(response) != "refresh":
+                break
+            await asyncio.to_thread(self.client.get_AccessToken)
+        if response.status_code != 200 or self.client.response_errcode(response) == "refresh":
+            raise IOError("导出数据失败！")
+        return self.client.export_out(eln_response_json(response)["dataset"],data_func)
+
+    async def update_data(self,
+                          eln_name:str,
+                          uid:str,
+                          module_name:str,
+                          module_type:str,
+                          data_func,
+                          data_in:Union[pd.Series,None]=None) -> List[dict]:
+        await self.prepare([eln_name])
+        add_module, add_data = self.client.update_template(module_name=module_name,
+                                                           module_type=module_type,
+                                                           data_func=data_func,
+                                                           data_in=data_in)
+        payload = self.client.update_json_data(
+                                               eln_name=eln_name,
+                                               uid=uid,
+                                               addModule = add_module,
+                                               add = add_data
+                                               )
+        ### 与同步客户端一致：Token失效时重新登录重试，errcode非0时抛出IOError
+        return await self.submit_chunks(url = self.client._update_url,
+                                        payload_func = lambda start,stop: payload,
+                                        ranges = [(0,1)],
+                                        error = "导入失败！")
+
+    async def update_dataset(self,
+                             eln_name:str,
+                             uid:str,
+                             module_name:List[str],
+                             module_type:List[str],
+                             data_func,
+                             data_in:Union[pd.DataFrame,None]=None,
+                             chunk_rows:Union[int,None]=None,
+                             chunk_bytes:Union[int,None]=None,
+                             only_changed:bool=False) -> List[dict]:
+        await self.prepare([eln_name])
+        rows = self.client.update_rows(module_name=module_name,
+                                       module_type=module_type,
+                                       data_func=data_func,
+                                       data_in=data_in)
+        rows,hashes = self.client.sync_filter(eln_name,uid,rows,only_changed)
+        status = await self.submit_chunks(url = self.client._update_url,
+                                          payload_func = lambda start,stop: self.client.update_chunk_json(eln_name,uid,rows,start,stop),
+                                          ranges = self.client.chunk_ranges(rows,chunk_rows,chunk_bytes),
+                                          error = "导入失败！")
+        self.client.sync_record(eln_name,uid,rows,hashes,status)
+        return status
+
+class eln_progress():
+    """命令行进度显示：已完成块数、行数、失败块数与吞吐量，按interval秒刷新一行"""
+    def __init__(self,
+                 total:Union[int,None] = None,
+                 stream = None,
+                 interval:float = 0.2) -> None:
+        self.total = total
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.rows = 0
+        self.start = time.perf_counter()
+        self._shown = 0.
+        self._lock = threading.Lock()
+
+    def __call__(self,status:dict):
+        with self._lock:
+            self.counts[status["status"]] += 1
+            self.rows += status["rows"][1] - status["rows"][0]
+            now = time.perf_counter()
+            if now - self._shown >= self.interval:
+                self._shown = now
+                self.show(now)
+
+    def show(self,now:float):
+        rows = f"{self.rows}/{self.total}" if self.total is not None else str(self.rows)
+        rate = self.rows / max(now - self.start,1e-9)
+        self.stream.write(f"\r块 {sum(self.counts.values())}  行 {rows}  失败 {self.counts['error']}  "
+                          f"跳过 {self.counts['skipped'] + self.counts['unchanged']}  {rate:.0f} 行/秒")
+        self.stream.flush()
+
+    def finish(self):
+        with self._lock:
+            self.show(time.perf_counter())
+            self.stream.write("\n")
+
+def eln_load_template(path:str) -> dict:
+    """
+    读取JSON模板文件：可以是eln_template的字段列表，
+    或{"fields":[...],"module_name":"{index}","module_type":"form"}
+    """
+    with open(path,encoding="utf-8") as f:
+        out = json.load(f)
+    if isinstance(out,list):
+        out = {"fields":out}
+    if "fields" not in out:
+        raise KeyError(f"模板文件{path}中没有fields！")
+    return out
+
+def eln_cli_ingest(args) -> int:
+    template = eln_load_template(args.template)
+    client = eln(pool_size=max(10,args.workers),
+                 limiter=True if args.adaptive else None,
+                 sync_index=eln_sync_index(args.sync_index) if args.only_changed else None)
+    if args.title is not None:
+        ### 记录不存在时先创建，重复运行不会产生重复记录
+        client.refresh_AccessToken()
+        if not any(True for _ in client.iter_datasets(eln_name_list=[args.eln],uids=[args.uid])):
+            client.import_data(eln_name=args.eln,
+                               template_name=args.record_template or args.title,
+                               title_list=[args.title],
+                               uid_list=[args.uid],
+                               keyword_list=[args.keyword or ""],
+                               dataset_in=[{}])
+    checkpoint = None
+    if not args.no_checkpoint:
+        checkpoint = args.checkpoint or f"{args.path}.{hashlib.sha1(f'{args.eln}|{args.uid}'.encode('utf-8')).hexdigest()[:8]}.ckpt"
+    read_kwargs = {} if args.index_col is None else {"index_col":int(args.index_col) if args.index_col.isdigit() else args.index_col}
+    progress = None if args.quiet else eln_progress(eln_count_rows(args.path))
+    try:
+        out = client.ingest_file(path=args.path,
+                                 eln_name=args.eln,
+                                 uid=args.uid,
+                                 data_func=eln_template(template["fields"]),
+                                 module_name=args.module_name or template.get("module_name","{index}"),
+                                 module_type=args.module_type or template.get("module_type","form"),
+                                 chunksize=args.chunksize,
+                                 max_workers=args.workers,
+                                 checkpoint=checkpoint,
+                                 only_changed=args.only_changed,
+                                 progress=progress,
+                                 **read_kwargs)
+    finally:
+        if progress is not None:
+            progress.finish()
+        client.close()
+    failed = [status for status in out if status["status"] == "error"]
+    for status in failed:
+        sys.stderr.write(f"块{status['chunk']} 行{status['rows'][0]}-{status['rows'][1]}: {status['error']}\n")
+    if checkpoint is not None:
+        if len(failed) > 0:
+            sys.stderr.write(f"重新运行相同命令将从断点{checkpoint}继续\n")
+        elif os.path.exists(checkpoint):
+            ### 全部上传成功后删除断点，之后重新运行会完整上传
+            os.remove(checkpoint)
+    return 1 if len(failed) > 0 else 0
+
+def eln_main(argv:Union[List[str],None] = None) -> int:
+    """命令行入口：python -m iop_eln ingest input.csv --template t.json --eln 测试 --uid arXiv"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m iop_eln",description="物理所电子实验平台命令行工具（账号读取环境变量eln_username/eln_password）")
+    commands = parser.add_subparsers(dest="command",required=True)
+    ingest = commands.add_parser("ingest",help="分块并行上传CSV/Parquet到一条记录，可断点续传")
+    ingest.add_argument("path",help="CSV或Parquet（.parquet/.pq）文件")
+    ingest.add_argument("--template",required=True,help="JSON模板文件，见eln_load_template")
+    ingest.add_argument("--eln",required=True,help="记录本名称")
+    ingest.add_argument("--uid",required=True,help="记录uid")
+    ingest.add_argument("--workers",type=int,default=4)
+    ingest.add_argument("--chunksize",type=int,default=1000,help="每块行数")
+    ingest.add_argument("--index-col",default=None,help="作为行索引（{index}）的列名或列号")
+    ingest.add_argument("--module-name",default=None,help="模块名格式，默认取模板中的module_name或{index}")
+    ingest.add_argument("--module-type",default=None,help="模块类型，默认取模板中的module_type或form")
+    ingest.add_argument("--checkpoint",default=None,help="断点文件，默认为<path>.<哈希>.ckpt；全部上传成功后删除")
+    ingest.add_argument("--no-checkpoint",action="store_true")
+    ingest.add_argument("--only-changed",action="store_true",help="按本地同步索引只上传内容有变化的模块")
+    ingest.add_argument("--sync-index",default=None,help="同步索引文件，默认~/.iop_eln/sync.sqlite")
+    ingest.add_argument("--adaptive",action="store_true",help="按服务器延迟与错误自适应调整并发")
+    ingest.add_argument("--title",default=None,help="记录不存在时以该标题创建")
+    ingest.add_argument("--keyword",default=None,help="创建记录时的关键词")
+    ingest.add_argument("--record-template",default=None,help="创建记录时的模板名，默认同标题")
+    ingest.add_argument("--quiet",action="store_true",help="不显示进度")
+    args = parser.parse_args(argv)
+    try:
+        return {"ingest":eln_cli_ingest}[args.command](args)
+    except (IOError,ValueError,KeyError,TypeError) as e: ### requests的异常均为IOError
+        sys.stderr.write(f"\n错误：{e}\n")
+        return 1
 
+if __name__ == "__main__":
+    sys.exit(eln_main())
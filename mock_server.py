@@ -0,0 +1,226 @@
+# -*- encoding: utf-8 -*-
+'''
+@File    :   mock_server.py
+@Project :
+@Time    :   2026/10/17 15:02:11
+@Author  :   Siyuan Wu
+@Version :   1.0
+@Contact :   sywu@iphy.ac.cn
+'''
+
+import json, time, random, threading, datetime, itertools, hashlib
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Union
+
+class eln_mock_handler(BaseHTTPRequestHandler):
+    """本地模拟服务器请求处理"""
+    protocol_version = "HTTP/1.1" ### 支持keep-alive，与真实服务器一样复用连接
+
+    def log_message(self,format,*args):
+        pass
+
+    def reply(self,out:Union[dict,bytes],status:int = 200):
+        body = out if isinstance(out,bytes) else json.dumps(out,ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type","application/json; charset=utf-8")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server.eln
+        length = int(self.headers.get("Content-Length",0))
+        body = self.rfile.read(length) if length > 0 else b""
+        path,_,query = self.path.partition("?")
+        if path.endswith("tokens2.php"):
+            name = "token"
+        elif "eln_api_" in path:
+            name = path.rsplit("eln_api_",1)[1].split(".")[0]
+        else:
+            self.reply({"errcode":2},404)
+            return
+        status,out = server.handle(name,
+                                   self.headers.get("Authorization",""),
+                                   json.loads(body) if body and self.headers.get("Content-Type","").startswith("application/json") else None,
+                                   len(body),
+                                   body = body,
+                                   query = {key:value[0] for key,value in parse_qs(query).items()})
+        self.reply(out,status)
+
+class eln_mock_server():
+    """
+    物理所电子实验平台本地模拟服务器：实现tokens2、elns、import、update、export接口，
+    可设置响应延迟与错误注入，用于离线测试与性能基准
+    """
+    def __init__(self,
+                 notebooks:List[str] = ["测试"],
+                 host:str = "127.0.0.1",
+                 port:int = 0,
+                 latency:float = 0.,
+                 jitter:float = 0.,
+                 error_rate:float = 0.,
+                 http_error_rate:float = 0.,
+                 token_ttl:float = 3600.,
+                 seed:Union[int,None] = None) -> None:
+        self.notebooks = {name:[] for name in notebooks}
+        self.records = {} ### (记录本,uid) -> 最新一条记录
+        self.blobs = {} ### SHA-256 -> 文件内容
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate ### 返回errcode 3的概率
+        self.http_error_rate = http_error_rate ### 返回HTTP 503的概率
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.stats = {}
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/open_eln"
+
+    @property
+    def token_url(self) -> str:
+        return f"http://{self.host}:{self.port}/open/tokens2.php"
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host,self.port),eln_mock_handler)
+        self._server.daemon_threads = True
+        self._server.eln = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*args):
+        self.stop()
+
+    def count(self,name:str,key:str,value:int = 1):
+        stats = self.stats.setdefault(name,{"requests":0,"errors":0,"bytes_in":0})
+        stats[key] += value
+
+    def handle(self,name:str,authorization:str,payload:Union[dict,None],size:int,body:bytes = b"",query:dict = {}) -> tuple:
+        with self._lock:
+            self.count(name,"requests")
+            self.count(name,"bytes_in",size)
+            delay = max(0.,self.latency + self._random.uniform(-self.jitter,self.jitter))
+            roll = self._random.random()
+        if delay > 0:
+            time.sleep(delay)
+        if name == "token":
+            return 200,self.token()
+        if roll < self.http_error_rate:
+            with self._lock:
+                self.count(name,"errors")
+            return 503,{"errcode":3}
+        if roll < self.http_error_rate + self.error_rate:
+            with self._lock:
+                self.count(name,"errors")
+            return 200,{"errcode":3}
+        token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+        with self._lock:
+            if self.tokens.get(token,0) < time.time():
+                return 200,{"errcode":"refresh"}
+            if name == "elns":
+                return 200,{"errcode":0,"my":[{"showtext":notebook} for notebook in self.notebooks]}
+            if name == "upload":
+                return 200,self.upload(body,query)
+            if payload is None:
+                return 200,{"errcode":2}
+            if name == "import":
+                return 200,self.import_data(payload)
+            if name == "update":
+                return 200,self.update_data(payload)
+            if name == "export":
+                ### 在锁内序列化，避免与并发的update同时读写记录
+                return 200,json.dumps(self.export_data(payload),ensure_ascii=False).encode("utf-8")
+        return 404,{"errcode":2}
+
+    def token(self) -> dict:
+        with self._lock:
+            token = f"mock{next(self._ids)}"
+            self.tokens[token] = time.time() + self.token_ttl
+        return {"access":{"token":token,"expires_in":self.token_ttl}}
+
+    def entry(self,name:str,data) -> dict:
+        data_type = "number" if isinstance(data,(int,float)) and not isinstance(data,bool) else ("bool" if isinstance(data,bool) else "text")
+        return {"uid":str(next(self._ids)),"name":name,"data":data,"type":data_type}
+
+    def upload(self,body:bytes,query:dict) -> dict:
+        ### 对应eln.upload_file的实验性接口约定，平台本身没有公开此接口
+        digest = hashlib.sha256(body).hexdigest()
+        if query.get("sha256",digest) != digest:
+            return {"errcode":2}
+        self.blobs[digest] = body
+        return {"errcode":0,"url":f"http://{self.host}:{self.port}/files/{digest}/{query.get('name','file')}"}
+
+    def import_data(self,payload:dict) -> dict:
+        if payload.get("eln") not in self.notebooks:
+            return {"errcode":2}
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for dataset in payload.get("dataset",[]):
+            data = dataset.get("data") or {}
+            record = {
+                      "eln_name":payload["eln"],
+                      "id":next(self._ids),
+                      "title":dataset.get("title"),
+                      "comm":"",
+                      "uid":dataset.get("uid"),
+                      "keyword":dataset.get("keyword"),
+                      "date":now,
+                      "data":[{
+                               "uid":str(next(self._ids)),
+                               "name":payload.get("template"),
+                               "type":"form",
+                               "data":[self.entry(key,value) for key,value in data.items()]
+                              }]
+                      }
+            self.notebooks[payload["eln"]].append(record)
+            self.records[(payload["eln"],record["uid"])] = record
+        return {"errcode":0}
+
+    def update_data(self,payload:dict) -> dict:
+        record = self.records.get((payload.get("eln"),payload.get("uid")))
+        if record is None:
+            return {"errcode":2}
+        modules = {module["name"]:module for module in record["data"]}
+        for module in payload.get("addModule",[]):
+            modules[module["name"]] = {"uid":str(next(self._ids)),"name":module["name"],"type":module["type"],"data":[]}
+            record["data"].append(modules[module["name"]])
+        for data in payload.get("add",[]):
+            if data.get("module") not in modules:
+                return {"errcode":2}
+            entry = self.entry(data.get("name"),data.get("data"))
+            entry["type"] = data.get("type",entry["type"])
+            modules[data["module"]]["data"].append(entry)
+        return {"errcode":0}
+
+    def export_data(self,payload:dict) -> dict:
+        out = []
+        for name in payload.get("eln",[]):
+            for record in self.notebooks.get(name,[]):
+                if "date_start" in payload and record["date"] < payload["date_start"]:
+                    continue
+                if "date_end" in payload and record["date"] >= payload["date_end"]:
+                    continue
+                if "uids" in payload and record["uid"] not in payload["uids"]:
+                    continue
+                if "keywords" in payload and record["keyword"] not in payload["keywords"]:
+                    continue
+                out.append(record)
+        return {"errcode":0,"dataset":out}
@@ -0,0 +1,23 @@
+import pytest
+from iop_eln import eln
+from mock_server import eln_mock_server
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("eln_username","user")
+    monkeypatch.setenv("eln_password","password")
+    with eln_mock_server(seed=0) as s:
+        yield s
+
+@pytest.fixture
+def connect(server):
+    """返回以模拟服务器为后端的客户端构造函数，不读写本地令牌缓存"""
+    def make(**kwargs):
+        return eln(token_store=False,base_url=server.base_url,token_url=server.token_url,**kwargs)
+    return make
+
+@pytest.fixture
+def record(connect):
+    """在模拟服务器上新建(测试,u1)记录，update类接口需要记录已存在"""
+    connect().import_data("测试","t",[{"a":1}],title_list=["x"],uid_list=["u1"])
+    return ("测试","u1")
@@ -0,0 +1,79 @@
+import pytest
+from iop_eln import eln_spool
+
+def value(i):
+    return lambda data_in: [{"data type":"number","data name":"v","data":i}]
+
+def update(client,i,uid = "u1"):
+    return client.update_data("测试",uid,f"m{i}","form",value(i))
+
+def modules(server,uid = "u1"):
+    return [(module["name"],module["data"][0]["data"]) for module in server.records[("测试",uid)]["data"][1:]]
+
+def test_flush_on_exit(connect,record,server):
+    client = connect()
+    with client.coalesce(max_delay=60):
+        futures = [update(client,i) for i in range(10)]
+        assert not any(future.done() for future in futures)
+    assert client.coalescer is None
+    assert all(future.result()["status"] == "OK" for future in futures)
+    assert server.stats["update"]["requests"] == 1
+    assert modules(server) == [(f"m{i}",i) for i in range(10)]
+
+def test_max_modules_sends_in_caller(connect,record,server):
+    client = connect()
+    with client.coalesce(max_modules=3,max_delay=60):
+        futures = [update(client,i) for i in range(7)]
+        assert [future.done() for future in futures] == [True] * 6 + [False]
+        assert server.stats["update"]["requests"] == 2
+    assert server.stats["update"]["requests"] == 3
+    assert modules(server) == [(f"m{i}",i) for i in range(7)]
+
+def test_max_bytes(connect,record):
+    client = connect()
+    with client.coalesce(max_bytes=1,max_delay=60):
+        future = update(client,0)
+        assert future.done()
+
+def test_max_delay_background_flush(connect,record,server):
+    client = connect()
+    with client.coalesce(max_delay=0.05):
+        future = update(client,0)
+        assert future.result(timeout=5)["status"] == "OK"
+        assert server.stats["update"]["requests"] == 1
+
+def test_one_request_per_record(connect,record,server):
+    client = connect()
+    client.import_data("测试","t",[{"a":1}],title_list=["y"],uid_list=["u2"])
+    with client.coalesce(max_delay=60):
+        update(client,0)
+        update(client,1,"u2")
+        update(client,2)
+    assert server.stats["update"]["requests"] == 2
+    assert modules(server) == [("m0",0),("m2",2)]
+    assert modules(server,"u2") == [("m1",1)]
+
+def test_failure_sets_exception(connect,record):
+    client = connect()
+    with client.coalesce(max_delay=60):
+        futures = [update(client,i,"missing") for i in range(3)]
+    for future in futures:
+        assert isinstance(future.exception(),IOError)
+
+def test_closed_coalescer_rejects(connect,record):
+    client = connect()
+    with client.coalesce() as coalescer:
+        pass
+    with pytest.raises(RuntimeError):
+        coalescer.add("测试","u1",[],[])
+
+def test_spooled(connect,record,server,tmp_path):
+    spool = eln_spool(str(tmp_path / "spool.sqlite"))
+    client = connect(spool=spool)
+    with client.coalesce(max_delay=60):
+        futures = [update(client,i) for i in range(3)]
+    assert [future.result()["status"] for future in futures] == ["spooled"] * 3
+    assert spool.counts() == {"pending":1}
+    client.flush_spool(timeout=5)
+    assert modules(server) == [(f"m{i}",i) for i in range(3)]
+    spool.close()
@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+import pytest
+from iop_eln import eln_template, eln_sync_index
+
+template = eln_template([{"column":"v","data name":"v","data type":"number"}])
+
+@pytest.fixture
+def csv(tmp_path):
+    path = str(tmp_path / "in.csv")
+    pd.DataFrame({"v":range(100)}).to_csv(path)
+    return path
+
+def modules(server):
+    return server.records[("测试","u1")]["data"][1:]
+
+def test_ingest_all_chunks(connect,record,server,csv):
+    status = connect().ingest_file(csv,"测试","u1",template,chunksize=30,max_workers=2,index_col=0)
+    assert [chunk["rows"] for chunk in status] == [(0,30),(30,60),(60,90),(90,100)]
+    assert all(chunk["status"] == "OK" for chunk in status)
+    assert sorted(int(module["name"]) for module in modules(server)) == list(range(100))
+
+def test_checkpoint_resume(connect,record,server,csv,tmp_path):
+    checkpoint = str(tmp_path / "ingest.ckpt")
+    client = connect()
+    def stop(status):
+        raise RuntimeError("中断")
+    with pytest.raises(RuntimeError):
+        client.ingest_file(csv,"测试","u1",template,chunksize=30,max_workers=1,queue_size=1,
+                           checkpoint=checkpoint,progress=stop,index_col=0)
+    sent = len(modules(server))
+    assert 0 < sent < 100
+    status = client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,index_col=0)
+    skipped = [chunk["chunk"] for chunk in status if chunk["status"] == "skipped"]
+    assert skipped == list(range(sent // 30))
+    assert sorted(int(module["name"]) for module in modules(server)) == list(range(100))
+    ### 全部完成后重新运行不再上传
+    requests = server.stats["update"]["requests"]
+    assert {chunk["status"] for chunk in client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,index_col=0)} == {"skipped"}
+    assert server.stats["update"]["requests"] == requests
+
+def test_checkpoint_rejects_changed_file(connect,record,csv,tmp_path):
+    checkpoint = str(tmp_path / "ingest.ckpt")
+    client = connect()
+    client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,index_col=0)
+    pd.DataFrame({"v":range(50)}).to_csv(csv)
+    with pytest.raises(ValueError):
+        client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,index_col=0)
+
+def test_checkpoint_rejects_changed_template(connect,record,csv,tmp_path):
+    checkpoint = str(tmp_path / "ingest.ckpt")
+    client = connect()
+    client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,index_col=0)
+    other = eln_template([{"column":"v","data name":"w","data type":"number"}])
+    with pytest.raises(ValueError):
+        client.ingest_file(csv,"测试","u1",other,chunksize=30,checkpoint=checkpoint,index_col=0)
+    with pytest.raises(ValueError):
+        client.ingest_file(csv,"测试","u1",template,chunksize=30,checkpoint=checkpoint,module_name="row{index}",index_col=0)
+    assert os.path.exists(checkpoint)
+
+def test_data_func_error_stops_ingest(connect,record,server,csv):
+    def fail(row):
+        raise KeyError("v")
+    with pytest.raises(KeyError):
+        connect().ingest_file(csv,"测试","u1",fail,chunksize=10,max_workers=2,queue_size=1,index_col=0)
+    assert "update" not in server.stats
+
+def test_only_changed_unchanged_chunks(connect,record,server,csv):
+    client = connect(sync_index=eln_sync_index(":memory:"))
+    client.ingest_file(csv,"测试","u1",template,chunksize=30,only_changed=True,index_col=0)
+    status = client.ingest_file(csv,"测试","u1",template,chunksize=30,only_changed=True,index_col=0)
+    assert {chunk["status"] for chunk in status} == {"unchanged"}
+    assert len(modules(server)) == 100
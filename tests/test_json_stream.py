@@ -0,0 +1,57 @@
+import json
+import pytest
+from iop_eln import eln_json_stream
+
+### 覆盖各类标量（含被截断时可被误解析的数字、字面量及多字节字符）
+sample = {
+    "errcode":0,
+    "dataset":[
+        {"name":"温度","value":1.5,"exp":2e3,"neg":-0.25e-2,"big":12345678901234567890},
+        [True,False,None,"a,b]}"],
+        7,
+        -3.75,
+        "中文字符串é",
+        {"nested":{"list":[1,2.0,{"k":"v"}]}},
+    ],
+    "errmsg":"ok",
+}
+
+def parse(chunks):
+    stream = eln_json_stream(chunks)
+    return list(stream),stream.fields
+
+@pytest.mark.parametrize("text",[json.dumps(sample,ensure_ascii=False),json.dumps(sample,ensure_ascii=False,indent=1)])
+def test_split_every_offset(text):
+    raw = text.encode("utf-8")
+    fields = {k:v for k,v in sample.items() if k != "dataset"}
+    for i in range(len(raw) + 1):
+        assert parse([raw[:i],raw[i:]]) == (sample["dataset"],fields),i
+
+def test_byte_chunks():
+    raw = json.dumps(sample,ensure_ascii=False).encode("utf-8")
+    items,_ = parse(raw[i:i + 1] for i in range(len(raw)))
+    assert items == sample["dataset"]
+
+@pytest.mark.parametrize("chunks,expected",[
+    ([b'{"dataset":[1.',b'5]}'],[1.5]),
+    ([b'{"dataset":[2e',b'3]}'],[2000.0]),
+    ([b'{"dataset":[-',b'1]}'],[-1]),
+    ([b'{"dataset":[tr',b'ue]}'],[True]),
+])
+def test_split_scalar(chunks,expected):
+    assert parse(chunks)[0] == expected
+
+def test_incomplete():
+    with pytest.raises(ValueError):
+        parse([b'{"dataset":[1,'])
+
+def test_large_value_many_chunks():
+    ### 单个大元素跨越大量分块，缓冲区只按倍数合并
+    item = {"data":[{"name":f"n{i}","data":i * 0.5} for i in range(20000)]}
+    raw = json.dumps({"dataset":[item,1]}).encode("utf-8")
+    stream = eln_json_stream(raw[i:i + 1024] for i in range(0,len(raw),1024))
+    joins = []
+    join = stream.join
+    stream.join = lambda: (joins.append(len(stream._pending)),join())
+    assert list(stream) == [item,1]
+    assert sum(1 for n in joins if n > 0) < 40
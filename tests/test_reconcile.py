@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+from iop_eln import eln_template, eln_sync_index
+
+template = eln_template([{"column":"title","data name":"标题","data type":"text"},
+                         {"column":"count","data name":"数量","data type":"number"}])
+data = pd.DataFrame({"title":[f"t{i}" for i in range(5)],"count":range(5)})
+names = [f"m{i}" for i in range(5)]
+
+def reconcile(client,frame = data,module_names = names,**kwargs):
+    return client.reconcile("测试","u1",module_names,["form"] * len(module_names),template,frame,**kwargs)
+
+def modules(server):
+    return [module["name"] for module in server.records[("测试","u1")]["data"]]
+
+def test_new_modules(connect,record,server):
+    report = reconcile(connect(),module_names=names[:3],frame=data.iloc[:3])
+    assert report["modules_added"] == names[:3]
+    assert len(report["entries_added"]) == 6
+    assert report["stale_modules"] == []
+    assert report["payload_bytes"] is None
+    assert modules(server) == ["t"] + names[:3]
+
+def test_dry_run_sends_nothing(connect,record,server):
+    client = connect()
+    reconcile(client,module_names=names[:3],frame=data.iloc[:3])
+    requests = server.stats["update"]["requests"]
+    changed = data.copy()
+    changed.loc[1,"count"] = 10
+    report = reconcile(client,changed,dry_run=True)
+    assert report["modules_added"] == ["m3","m4"]
+    assert report["entries_changed"] == [("m1","数量")]
+    assert report["unchanged"] == 5
+    assert report["payload_bytes"] > 0
+    assert report["status"] == []
+    assert server.stats["update"]["requests"] == requests
+
+def test_unchanged_sends_nothing(connect,record,server):
+    client = connect()
+    reconcile(client)
+    requests = server.stats["update"]["requests"]
+    report = reconcile(client)
+    assert report["unchanged"] == 10
+    assert report["status"] == []
+    assert server.stats["update"]["requests"] == requests
+
+def test_append_only(connect,record,server):
+    client = connect()
+    reconcile(client)
+    changed = data.copy()
+    changed.loc[2,"title"] = "new"
+    changed.loc[3,"count"] = 30
+    report = reconcile(client,changed,verify=True)
+    assert report["entries_changed"] == [("m2","标题"),("m3","数量")]
+    assert report["verified"] == {"ok":True,"duplicate_modules":[],"mismatched":[]}
+    ### 已有模块不再新建，变化的数据项追加为同名新项
+    assert modules(server) == ["t"] + names
+    entries = server.records[("测试","u1")]["data"][3]["data"]
+    assert [(entry["name"],entry["data"]) for entry in entries] == [("标题","t2"),("数量",2),("标题","new")]
+    assert reconcile(client,changed)["status"] == []
+
+def test_send_changed_false(connect,record,server):
+    client = connect()
+    reconcile(client)
+    requests = server.stats["update"]["requests"]
+    changed = data.copy()
+    changed.loc[0,"count"] = 7
+    report = reconcile(client,changed,send_changed=False)
+    assert report["entries_changed"] == [("m0","数量")]
+    assert report["status"] == []
+    assert server.stats["update"]["requests"] == requests
+
+def test_stale_modules_exclude_template(connect,record,server):
+    client = connect()
+    reconcile(client)
+    report = reconcile(client,data.iloc[2:],names[2:],dry_run=True)
+    assert report["stale_modules"] == ["m0","m1"]
+    assert reconcile(client,data.iloc[2:],names[2:],dry_run=True,template_modules=[])["stale_modules"] == ["m0","m1","t"]
+    ### 只报告，不删除
+    reconcile(client,data.iloc[2:],names[2:])
+    assert modules(server) == ["t"] + names
+
+def test_sync_index_recorded(connect,record):
+    client = connect(sync_index=eln_sync_index(":memory:"))
+    reconcile(client,data.iloc[:2],names[:2])
+    reconcile(client)
+    assert sorted(client.sync_index.known("测试","u1",names)) == names
+
+def test_missing_record(connect,record):
+    with pytest.raises(KeyError):
+        connect().reconcile("测试","missing",names,["form"] * 5,template,data)
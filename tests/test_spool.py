@@ -0,0 +1,89 @@
+import time
+import pandas as pd
+import pytest
+from iop_eln import eln_spool, eln_sync_index
+
+names = [f"m{i}" for i in range(6)]
+data = pd.DataFrame({"v":range(6)})
+
+def template(offset = 0):
+    return lambda row: [{"data type":"number","data name":"v","data":int(row["v"]) + offset}]
+
+@pytest.fixture
+def spooled(connect,record,tmp_path):
+    spool = eln_spool(str(tmp_path / "spool.sqlite"))
+    client = connect(spool=spool,sync_index=eln_sync_index(":memory:"))
+    yield client
+    client.stop_spool()
+    spool.close()
+
+def module_names(server):
+    return [module["name"] for module in server.records[("测试","u1")]["data"]]
+
+def test_spool_returns_without_sending(spooled,server):
+    status = spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,chunk_rows=2)
+    assert [chunk["status"] for chunk in status] == ["spooled"] * 3
+    assert "update" not in server.stats
+    assert spooled.spool.counts() == {"pending":3}
+
+def test_flush_replays_in_order(spooled,server):
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,chunk_rows=2)
+    assert spooled.flush_spool(timeout=10) == {"done":3}
+    assert module_names(server)[1:] == names
+    assert server.stats["update"]["requests"] == 3
+
+def test_sync_index_recorded_after_replay(spooled):
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,only_changed=True)
+    assert spooled.sync_index.known("测试","u1",names) == {}
+    spooled.flush_spool(timeout=10)
+    assert sorted(spooled.sync_index.known("测试","u1",names)) == names
+
+def test_only_changed_skips_queued(spooled,server):
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,only_changed=True)
+    ### 内容与尚未回放的数据相同，不再写入
+    assert spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,only_changed=True) == []
+    changed = data.copy()
+    changed.loc[0,"v"] = 100
+    status = spooled.update_dataset("测试","u1",names,["form"] * 6,template(),changed,only_changed=True)
+    assert [chunk["rows"] for chunk in status] == [(0,1)]
+    spooled.flush_spool(timeout=10)
+    assert module_names(server)[1:] == names + ["m0"]
+
+def test_lease_blocks_other_drainer(spooled,server):
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,chunk_rows=3)
+    other = eln_spool(spooled.spool.path,lease=0.5)
+    held = other.claim(10)
+    assert len(held) == 2
+    ### 租约未到期时其他回放方取不到数据
+    assert spooled.drain_spool() == 0
+    assert spooled.flush_spool(timeout=5) == {"done":2}
+    assert server.stats["update"]["requests"] == 2
+    other.close()
+
+def test_expired_lease_requeued_on_open(spooled):
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data)
+    other = eln_spool(spooled.spool.path,lease=-1)
+    other.claim(10)
+    other.close()
+    assert eln_spool(spooled.spool.path).counts() == {"pending":1}
+
+def test_failed_attempts_and_requeue(connect,record,server,tmp_path):
+    spool = eln_spool(str(tmp_path / "spool.sqlite"),max_attempts=1)
+    client = connect(spool=spool)
+    client.update_dataset("测试","u2",names,["form"] * 6,template(),data)
+    assert client.flush_spool(timeout=5) == {"failed":1}
+    assert len(spool.failed()) == 1
+    server.records[("测试","u2")] = server.records[("测试","u1")]
+    spool.requeue()
+    assert client.flush_spool(timeout=5) == {"done":1}
+    spool.close()
+
+def test_background_replay(spooled,server):
+    spooled.start_spool(interval=0.05)
+    spooled.update_dataset("测试","u1",names,["form"] * 6,template(),data,chunk_rows=3)
+    for _ in range(100):
+        if spooled.spool.counts() == {"done":2}:
+            break
+        time.sleep(0.05)
+    assert spooled.spool.counts() == {"done":2}
+    assert module_names(server)[1:] == names